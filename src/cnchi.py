@@ -31,6 +31,7 @@
 import os
 import sys
 import shutil
+import subprocess
 import logging
 import logging.handlers
 import gettext
@@ -215,6 +216,15 @@ class CnchiInit():
         # Setup our logging framework
         self.setup_logging()
 
+        if self.cmd_line.bundle:
+            # Offline installation using a package bundle
+            self.mount_bundle()
+
+        if self.cmd_line.serve_cache:
+            # Only share our package cache with other installs in the LAN
+            self.serve_cache()
+            sys.exit(0)
+
         # Enables needed repositories only if it's not enabled
         self.enable_repositories()
 
@@ -353,6 +363,28 @@ class CnchiInit():
         else:
             logging.warning(BUGSNAG_ERROR)
 
+    def mount_bundle(self):
+        """ Mounts the package bundle (if it's a squashfs image) """
+        from download import bundle
+        try:
+            self.cmd_line.bundle = bundle.mount(
+                self.cmd_line.bundle, CnchiInit.TEMP_FOLDER)
+        except (OSError, ValueError, subprocess.CalledProcessError) as err:
+            logging.error("Can't use package bundle %s: %s", self.cmd_line.bundle, err)
+            sys.exit(1)
+
+    def serve_cache(self):
+        """ Serves local cached packages to the LAN (until Ctrl+C) """
+        from download import lan_cache
+        cache_dirs = ["/var/cache/pacman/pkg"]
+        if self.cmd_line.cache and self.cmd_line.cache not in cache_dirs:
+            cache_dirs.append(self.cmd_line.cache)
+        try:
+            lan_cache.serve(cache_dirs, self.cmd_line.serve_cache)
+        except OSError as err:
+            logging.error("Can't serve package cache: %s", err)
+            sys.exit(1)
+
     @staticmethod
     def check_gtk_version():
         """ Check GTK version """
@@ -447,6 +479,12 @@ class CnchiInit():
         parser.add_argument(
             "-a", "--a11y", help=_("Set accessibility feature on by default"),
             action="store_true")
+        parser.add_argument(
+            "--aria2", help=_("Download packages using aria2c (if available)"),
+            action="store_true")
+        parser.add_argument(
+            "--bundle", help=_("Install using only the packages of this bundle (directory or squashfs image)"),
+            nargs='?')
         parser.add_argument(
             "-c", "--cache", help=_("Use pre-downloaded xz packages when possible"),
             nargs='?')
@@ -459,18 +497,30 @@ class CnchiInit():
         parser.add_argument(
             "-f", "--force", help=_("Runs cnchi even when another instance is running"),
             action="store_true")
+        parser.add_argument(
+            "--lan-discover", help=_("Look for package caches shared by other computers in the LAN"),
+            action="store_true")
+        parser.add_argument(
+            "--lan-mirror", help=_("Download packages from this LAN package cache first (url)"),
+            action="append")
         parser.add_argument(
             "-n", "--no-check", help=_("Makes checks optional in check screen"),
             action="store_true")
         parser.add_argument(
             "-p", "--packagelist", help=_("Install packages referenced by a local XML file"),
             nargs='?')
+        parser.add_argument(
+            "--prefetch", help=_("Download packages while the installer questions are answered"),
+            action="store_true")
         parser.add_argument(
             "-r", "--logresources", help=_("Logs resources usage (for debugging purposes)"),
             action="store_true")
         parser.add_argument(
             "-s", "--logserver", help=_("Log server (deprecated, always uses bugsnag)"),
             nargs='?')
+        parser.add_argument(
+            "--serve-cache", help=_("Share cached packages with other computers in the LAN and quit"),
+            nargs='?', type=int, const=8079, metavar="PORT")
         parser.add_argument(
             "-t", "--no-tryit", help=_("Disables first screen's 'try it' option"),
             action="store_true")
@@ -29,7 +29,104 @@
 
 """ Configuration module for Cnchi """
 
-import multiprocessing
+import threading
+import time
+
+from multiprocessing.managers import BaseManager
+
+
+class SettingsStore():
+    """ Settings dictionary. It lives in the manager process, and Settings
+        objects (in any process) read and write one key at a time.
+        Each key has a version number that grows when it is set, so
+        clients can wait until a key changes """
+
+    def __init__(self):
+        self._values = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def get(self, key):
+        """ Get one setting value """
+        with self._lock:
+            return self._values.get(key, None)
+
+    def get_versioned(self, key):
+        """ Get one setting value and its version """
+        with self._lock:
+            return self._values.get(key, None), self._versions.get(key, 0)
+
+    def set(self, key, value):
+        """ Set one setting value. If the current value is a non empty list
+            and value is not a list, value is appended to it """
+        with self._lock:
+            current = self._values.get(key, None)
+            if current and isinstance(current, list) and not isinstance(value, list):
+                current.append(value)
+            else:
+                self._values[key] = value
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._changed.notify_all()
+
+    def update(self, values):
+        """ Set several setting values at once """
+        with self._lock:
+            self._values.update(values)
+            for key in values:
+                self._versions[key] = self._versions.get(key, 0) + 1
+            self._changed.notify_all()
+
+    def wait_change(self, key, version, timeout=None):
+        """ Waits until key's version is not version (or timeout seconds
+            pass). Returns its current value and version """
+        with self._lock:
+            self._changed.wait_for(
+                lambda: self._versions.get(key, 0) != version, timeout)
+            return self._values.get(key, None), self._versions.get(key, 0)
+
+    def copy(self):
+        """ Get a copy of all settings """
+        with self._lock:
+            return self._values.copy()
+
+
+class SettingsManager(BaseManager):
+    """ Runs the SettingsStore shared by all Cnchi processes """
+    pass
+
+
+SettingsManager.register('SettingsStore', SettingsStore)
+
+
+class Subscription(threading.Thread):
+    """ Calls callback(key, value) each time key is set (see
+        Settings.subscribe) """
+
+    def __init__(self, store, key, callback):
+        super().__init__(daemon=True)
+        self.store = store
+        self.key = key
+        self.callback = callback
+        self.cancelled = False
+        _value, self.version = store.get_versioned(key)
+
+    def run(self):
+        while not self.cancelled:
+            try:
+                value, version = self.store.wait_change(self.key, self.version)
+            except (EOFError, OSError):
+                # Settings manager has been shut down
+                break
+            if self.cancelled:
+                break
+            self.version = version
+            self.callback(self.key, value)
+
+    def cancel(self):
+        """ No more calls to callback (the thread ends the next time key
+            is set) """
+        self.cancelled = True
 
 
 class Settings():
@@ -37,16 +134,17 @@ class Settings():
 
     def __init__(self):
         """ Initialize default configuration """
-        self._manager = multiprocessing.Manager()
+        self._manager = SettingsManager()
+        self._manager.start()
 
-        # Creates a one element size queue
-        self._settings = self._manager.Queue(1)
+        # Each get or set is a single call to the manager process
+        self._settings = self._manager.SettingsStore()
 
         self._set_defaults()
 
     def _set_defaults(self):
         """ Set default values """
-        self._settings.put({
+        self._settings.update({
             'alternate_package_list': '',
             'auto_device': '/dev/sda',
             'bootloader': 'grub2',
@@ -54,6 +152,7 @@ class Settings():
             'bootloader_install': True,
             'bootloader_installation_successful': False,
             'btrfs': False,
+            'bundle': None,
             'cache_pkgs_md5_check_failed': [],
             'cnchi': '/usr/share/cnchi/',
             'country_name': '',
@@ -63,6 +162,10 @@ class Settings():
             'desktop_ask': True,
             'desktop_manager': 'lightdm',
             'desktops': [],
+            'download_ahead': True,
+            'download_backend': 'requests',
+            'download_prefetch': False,
+            'download_workers': 6,
             'enable_alongside': True,
             'encrypt_home': False,
             'f2fs': False,
@@ -83,6 +186,7 @@ class Settings():
             'feature_lembrame': False,
             'fullname': '',
             'GRUB_CMDLINE_LINUX': '',
+            'has_internet': False,
             'hostname': 'antergos',
             'install_id': '',
             'is_vbox': False,
@@ -90,15 +194,19 @@ class Settings():
             'keyboard_variant': '',
             'language_name': '',
             'language_code': '',
+            'lan_discover': False,
+            'lan_mirrors': [],
             'location': '',
             'laptop': 'False',
             'locale': '',
             'luks_root_password': '',
             'luks_root_volume': '',
             'luks_root_device': '',
+            'network_changes': 0,
             'network_manager': 'NetworkManager',
             'pacman_config_file': '/etc/pacman.conf',
             'partition_mode': 'automatic',
+            'prefetch_running': False,
             'proxies': None,
             'rankmirrors_done': False,
             'rankmirrors_pipe': None,
@@ -135,35 +243,35 @@ class Settings():
             'zfs_pool_name': 'antergos',
             'zfs_pool_id': 0})
 
-    def _get_settings(self):
-        """ Get a copy of our settings """
-        settings = self._settings.get()
-        copy = settings.copy()
-        self._settings.put(settings)
-        return copy
-
-    def _update_settings(self, new_settings):
-        """ Updates global settings """
-        settings = self._settings.get()
-        try:
-            settings.update(new_settings)
-        finally:
-            self._settings.put(settings)
-
     def get(self, key):
         """ Get one setting value """
-        settings = self._get_settings()
-        return settings.get(key, None)
+        return self._settings.get(key)
 
     def set(self, key, value):
         """ Set one setting value """
-        settings = self._get_settings()
-        current = settings.get(key, 'keyerror')
-        exists = current != 'keyerror'
+        self._settings.set(key, value)
 
-        if exists and current and isinstance(current, list) and not isinstance(value, list):
-            settings[key].append(value)
-        else:
-            settings[key] = value
+    def wait_for(self, key, predicate=bool, timeout=None):
+        """ Sleeps until predicate(value of key) is true, without polling
+            (it only wakes up when key is set). Returns False if timeout
+            seconds pass first """
+        value, version = self._settings.get_versioned(key)
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while not predicate(value):
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+            value, version = self._settings.wait_change(key, version, remaining)
+        return True
 
-        self._update_settings(settings)
+    def subscribe(self, key, callback):
+        """ Calls callback(key, value), from a thread of this process,
+            each time key is set. Returns the Subscription (use its
+            cancel() method to stop) """
+        subscription = Subscription(self._settings, key, callback)
+        subscription.start()
+        return subscription
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bundle.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Offline package bundles (see utils/build_bundle.py). A bundle is a
+    directory (or a squashfs image of it) with this layout:
+
+        manifest.json   bundle description and package list
+        packages.xml    Cnchi package list used to build the bundle
+        repo/           sync databases (core.db, extra.db...) and packages
+
+    When Cnchi is started with --bundle, repo/ is the only repository used,
+    so no network connection is needed to install. """
+
+import json
+import logging
+import os
+import subprocess
+
+import misc.extra as misc
+
+MANIFEST_NAME = 'manifest.json'
+PACKAGES_XML_NAME = 'packages.xml'
+REPO_DIR_NAME = 'repo'
+
+# Manifest format version
+MANIFEST_VERSION = 1
+
+
+def load_manifest(bundle_dir):
+    """ Reads and checks the bundle manifest. Raises ValueError if the
+        bundle is not valid """
+    path = os.path.join(bundle_dir, MANIFEST_NAME)
+    try:
+        with open(path, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except OSError as err:
+        raise ValueError("Can't read bundle manifest {0}: {1}".format(path, err))
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(
+            "Unsupported bundle manifest version: {0}".format(manifest.get('version')))
+
+    repo_dir = os.path.join(bundle_dir, REPO_DIR_NAME)
+    for repo in manifest.get('repos', []):
+        db_path = os.path.join(repo_dir, repo + '.db')
+        if not os.path.exists(db_path):
+            raise ValueError("Bundle database {0} is missing".format(db_path))
+
+    arch = manifest.get('arch')
+    if arch and arch != os.uname()[-1]:
+        raise ValueError(
+            "Bundle was built for {0}, not {1}".format(arch, os.uname()[-1]))
+
+    return manifest
+
+
+def mount(bundle_path, temp_dir):
+    """ Makes the bundle contents available. Squashfs images are mounted
+        (read only) in temp_dir. Returns the bundle directory """
+    if os.path.isdir(bundle_path):
+        bundle_dir = os.path.abspath(bundle_path)
+    else:
+        bundle_dir = os.path.join(temp_dir, 'bundle')
+        if not os.path.ismount(bundle_dir):
+            with misc.raised_privileges():
+                os.makedirs(bundle_dir, mode=0o755, exist_ok=True)
+                cmd = ['mount', '-t', 'squashfs', '-o', 'loop,ro', bundle_path, bundle_dir]
+                subprocess.check_call(cmd)
+            logging.debug("Bundle %s mounted in %s", bundle_path, bundle_dir)
+
+    manifest = load_manifest(bundle_dir)
+    logging.debug(
+        "Using package bundle %s (%d packages, created %s)",
+        bundle_dir, len(manifest.get('packages', [])), manifest.get('created'))
+    return bundle_dir
+
+
+def get_repo_dir(bundle_dir):
+    """ Directory with the bundle databases and packages """
+    return os.path.join(bundle_dir, REPO_DIR_NAME)
+
+
+def create_pacman_conf(bundle_dir, conf_path, db_path):
+    """ Writes a pacman.conf that only uses the bundle repositories. A
+        separate db_path is used so live system databases are not touched """
+    repo_dir = get_repo_dir(bundle_dir)
+    manifest = load_manifest(bundle_dir)
+
+    lines = [
+        '[options]',
+        'Architecture = auto',
+        'SigLevel = Required DatabaseOptional',
+        'LocalFileSigLevel = Optional',
+        'DBPath = {0}/'.format(db_path),
+        'CacheDir = {0}/'.format(repo_dir),
+        'LogFile = /var/log/cnchi/pacman.log',
+        '']
+    for repo in manifest['repos']:
+        lines.extend([
+            '[{0}]'.format(repo),
+            'Server = file://{0}'.format(repo_dir),
+            ''])
+
+    os.makedirs(os.path.join(db_path, 'local'), mode=0o755, exist_ok=True)
+    with open(conf_path, 'w') as conf_file:
+        conf_file.write('\n'.join(lines))
+
+
+def setup(bundle_dir, settings):
+    """ Configures Cnchi to install from the bundle """
+    temp_dir = settings.get('temp')
+    conf_path = os.path.join(temp_dir, 'bundle-pacman.conf')
+    db_path = os.path.join(temp_dir, 'bundle-db')
+    with misc.raised_privileges():
+        create_pacman_conf(bundle_dir, conf_path, db_path)
+
+    settings.set('bundle', bundle_dir)
+    settings.set('pacman_config_file', conf_path)
+
+    # Packages are copied from the bundle as if it were a cache
+    xz_cache = settings.get('xz_cache')
+    repo_dir = get_repo_dir(bundle_dir)
+    if repo_dir not in xz_cache:
+        settings.set('xz_cache', [repo_dir] + xz_cache)
+
+    # Use the same package list the bundle was built with
+    packages_xml = os.path.join(bundle_dir, PACKAGES_XML_NAME)
+    if not settings.get('alternate_package_list') and os.path.exists(packages_xml):
+        settings.set('alternate_package_list', packages_xml)
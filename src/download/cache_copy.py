@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache_copy.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Copies packages between cache directories as cheaply as possible """
+
+import fcntl
+import logging
+import os
+import queue
+import shutil
+import threading
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def _reflink(src_fd, dst_fd, _size):
+    """ Shares src data blocks with dst (btrfs, xfs) """
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    """ Copies data inside the kernel (server side copy on NFS) """
+    copied = 0
+    while copied < size:
+        done = os.copy_file_range(src_fd, dst_fd, size - copied)
+        if done == 0:
+            break
+        copied += done
+    if copied != size:
+        raise OSError("copy_file_range copied {0} of {1} bytes".format(copied, size))
+
+
+def _sendfile(src_fd, dst_fd, size):
+    """ Copies data inside the kernel """
+    copied = 0
+    while copied < size:
+        done = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if done == 0:
+            break
+        copied += done
+    if copied != size:
+        raise OSError("sendfile copied {0} of {1} bytes".format(copied, size))
+
+
+def fast_copy(src, dst, allow_link=True):
+    """ Copies src to dst trying (in this order) a hardlink, a reflink,
+        copy_file_range and sendfile before falling back to a normal copy.
+        Data is copied to a temporary file that is renamed when complete.
+        Returns the method that was used. """
+    tmp_dst = dst + '.part'
+
+    if allow_link:
+        try:
+            if os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev:
+                if os.path.exists(tmp_dst):
+                    os.remove(tmp_dst)
+                os.link(src, tmp_dst)
+                os.replace(tmp_dst, dst)
+                return 'link'
+        except OSError as err:
+            logging.debug("Can't link %s to %s: %s", src, dst, err)
+
+    copy_functions = [('reflink', _reflink)]
+    if hasattr(os, 'copy_file_range'):
+        copy_functions.append(('copy_file_range', _copy_file_range))
+    if hasattr(os, 'sendfile'):
+        copy_functions.append(('sendfile', _sendfile))
+
+    size = os.path.getsize(src)
+    for method, copy_function in copy_functions:
+        try:
+            with open(src, 'rb') as src_file, open(tmp_dst, 'wb') as dst_file:
+                copy_function(src_file.fileno(), dst_file.fileno(), size)
+            os.replace(tmp_dst, dst)
+            return method
+        except OSError:
+            # Not supported here, try the next one
+            pass
+
+    shutil.copyfile(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+    return 'copy'
+
+
+def move_file(src, dst):
+    """ Moves src to dst. A rename is used if both are in the same
+        filesystem, if not src is copied (see fast_copy) and deleted """
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as err:
+        logging.debug("Can't rename %s to %s: %s", src, dst, err)
+    fast_copy(src, dst, allow_link=False)
+    os.remove(src)
+
+
+class CacheWriter():
+    """ Copies downloaded packages to the user's cache directories in the
+        background. There is one thread (and one bounded queue) for each
+        target device, so copies to the same disk do not fight each other. """
+
+    # Avoid writing to the ISO itself
+    PACMAN_ISO_CACHE = "/var/cache/pacman/pkg"
+
+    # If a device can't keep up, downloads wait for it
+    QUEUE_SIZE = 32
+
+    def __init__(self, cache_dirs):
+        # device -> list of cache dirs in that device
+        self.devices = {}
+        for cache_dir in cache_dirs:
+            if cache_dir == CacheWriter.PACMAN_ISO_CACHE:
+                continue
+            try:
+                device = os.stat(cache_dir).st_dev
+            except OSError as err:
+                logging.debug("Can't use %s as cache: %s", cache_dir, err)
+                continue
+            self.devices.setdefault(device, []).append(cache_dir)
+
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.threads = []
+
+    def get_queue(self, device):
+        """ Returns device queue, starting its thread if necessary """
+        with self.lock:
+            if device not in self.queues:
+                device_queue = queue.Queue(CacheWriter.QUEUE_SIZE)
+                thread = threading.Thread(
+                    target=self.worker,
+                    args=(device_queue, self.devices[device]),
+                    daemon=True)
+                thread.start()
+                self.queues[device] = device_queue
+                self.threads.append(thread)
+            return self.queues[device]
+
+    def add(self, path):
+        """ Queues path to be copied to all cache dirs """
+        for device in self.devices:
+            self.get_queue(device).put(path)
+
+    @staticmethod
+    def worker(device_queue, cache_dirs):
+        """ Copies queued files to cache_dirs (all of them in one device) """
+        while True:
+            path = device_queue.get()
+            if path is None:
+                break
+            basename = os.path.basename(path)
+            for cache_dir in cache_dirs:
+                dst = os.path.join(cache_dir, basename)
+                # Try to copy the file, do not worry if it's not possible
+                try:
+                    fast_copy(path, dst)
+                except OSError as err:
+                    logging.debug("Can't copy %s to %s: %s", path, dst, err)
+
+    def join(self):
+        """ Waits until all queued files have been copied """
+        with self.lock:
+            for device_queue in self.queues.values():
+                device_queue.put(None)
+            threads = self.threads
+            self.queues = {}
+            self.threads = []
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Index of package cache directories with their already verified hashes """
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+try:
+    import download.download_hash as dhash
+except ModuleNotFoundError:
+    import download_hash as dhash
+
+
+class CacheIndex():
+    """ Knows which files a package cache directory has (using one scandir
+        call instead of checking each package) and remembers the hashes of
+        the files that have already been verified. Hashes are stored in a
+        database next to the packages, so they survive between installs.
+        A stored hash is only used if the file size, mtime and inode are
+        still the same. """
+
+    HASH_DB_NAME = '.cnchi-hashes.json'
+
+    # Used when the cache directory is read only
+    FALLBACK_DB_DIR = '/var/tmp/cnchi/hashes'
+
+    def __init__(self, cache_dir, persistent=True):
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        # filename -> path
+        self.files = {}
+        # filename -> {'size': ..., 'mtime': ..., 'inode': ..., 'sha256': ...}
+        self.hashes = {}
+        self.modified = False
+
+        self.db_path = None
+        if persistent:
+            self.db_path = self.get_db_path()
+
+        self.scan()
+        self.load()
+
+    def get_db_path(self):
+        """ Where the hash database of this directory is stored """
+        if os.access(self.cache_dir, os.W_OK):
+            return os.path.join(self.cache_dir, CacheIndex.HASH_DB_NAME)
+        name = hashlib.md5(self.cache_dir.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(CacheIndex.FALLBACK_DB_DIR, name)
+
+    def scan(self):
+        """ Reads directory contents """
+        self.files = {}
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or entry.name.endswith('.part'):
+                        continue
+                    if entry.is_file():
+                        self.files[entry.name] = entry.path
+        except OSError as err:
+            logging.debug("Can't read %s: %s", self.cache_dir, err)
+
+    def load(self):
+        """ Loads stored hashes (if any) """
+        if not self.db_path or not os.path.exists(self.db_path):
+            return
+        try:
+            with open(self.db_path, 'r') as db_file:
+                self.hashes = json.load(db_file)
+        except (OSError, ValueError) as err:
+            logging.debug("Can't load hash database %s: %s", self.db_path, err)
+            self.hashes = {}
+
+    def save(self):
+        """ Stores hashes (only files still in the directory are kept) """
+        if not self.db_path or not self.modified:
+            return
+        with self.lock:
+            hashes = {
+                name: entry for name, entry in self.hashes.items()
+                if name in self.files}
+        try:
+            os.makedirs(os.path.dirname(self.db_path), mode=0o755, exist_ok=True)
+            tmp_path = self.db_path + '.tmp'
+            with open(tmp_path, 'w') as db_file:
+                json.dump(hashes, db_file)
+            os.replace(tmp_path, self.db_path)
+            self.modified = False
+        except OSError as err:
+            logging.debug("Can't save hash database %s: %s", self.db_path, err)
+
+    def get_path(self, filename):
+        """ Returns the path of filename if it is in this cache """
+        return self.files.get(filename)
+
+    def add(self, filename):
+        """ Tells the index that filename has been added to the directory """
+        self.files[filename] = os.path.join(self.cache_dir, filename)
+
+    @staticmethod
+    def get_file_info(path):
+        """ Returns the info that identifies a version of a file """
+        stat = os.stat(path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'inode': stat.st_ino}
+
+    def get_digest(self, path, hash_type):
+        """ Returns the stored digest of path, or computes and stores it """
+        filename = os.path.basename(path)
+        info = self.get_file_info(path)
+
+        with self.lock:
+            entry = self.hashes.get(filename)
+            if entry and all(entry.get(key) == value for key, value in info.items()):
+                digest = entry.get(hash_type)
+                if digest:
+                    return digest
+            else:
+                # Unknown or changed file, throw away what we knew about it
+                entry = None
+
+        digest = dhash.get_file_hash(path, hash_type)
+
+        with self.lock:
+            if entry is None:
+                entry = dict(info)
+                self.hashes[filename] = entry
+            entry[hash_type] = digest
+            self.modified = True
+        return digest
+
+    def remember(self, path, hash_type, digest):
+        """ Stores the digest of a file that has just been verified """
+        filename = os.path.basename(path)
+        entry = self.get_file_info(path)
+        entry[hash_type] = digest
+        with self.lock:
+            self.files[filename] = path
+            self.hashes[filename] = entry
+            self.modified = True
+
+    def check_hash(self, path, element):
+        """ Same as download_hash.check_hash, but files that have
+            already been verified are not read again """
+        hash_type, _expected = dhash.get_expected_hash(element)
+        digest = None
+        try:
+            if hash_type:
+                digest = self.get_digest(path, hash_type)
+        except OSError as err:
+            logging.debug(err)
+            return False
+        return dhash.check_digest(element, hash_type, digest, path)
@@ -37,6 +37,8 @@ try:
     import pacman.pac as pac
     import download.metalink as ml
     import download.download_requests as download_requests
+    import download.download_aria2 as download_aria2
+    import download.lan_cache as lan_cache
 except ModuleNotFoundError:
     import sys
     CNCHI_PATH = "/usr/share/cnchi"
@@ -45,6 +47,8 @@ except ModuleNotFoundError:
     import pacman.pac as pac
     import metalink as ml
     import download_requests
+    import download_aria2
+    import lan_cache
 
 from misc.events import Events
 import misc.extra as misc
@@ -60,8 +64,10 @@ class DownloadPackages():
     """ Class to download packages. This class tries to previously download
         all necessary packages for  Antergos installation using requests. """
 
-    def __init__(self, package_names, pacman_conf, settings=None, callback_queue=None):
-        """ Initialize DownloadPackages class. Gets default configuration """
+    def __init__(self, package_names, pacman_conf, settings=None, callback_queue=None,
+                 staging_dir=None):
+        """ Initialize DownloadPackages class. Gets default configuration.
+            Packages already downloaded to staging_dir are used (moved) """
 
         self.package_names = package_names
 
@@ -71,8 +77,15 @@ class DownloadPackages():
         self.settings = settings
         if self.settings:
             self.xz_cache_dirs = self.settings.get('xz_cache')
+            # Other Cnchi installs sharing their package cache
+            self.lan_mirrors = lan_cache.get_mirrors(self.settings)
         else:
             self.xz_cache_dirs = []
+            self.lan_mirrors = []
+
+        self.staging_dirs = []
+        if staging_dir:
+            self.staging_dirs.append(staging_dir)
 
         self.events = Events(callback_queue)
 
@@ -84,8 +97,15 @@ class DownloadPackages():
         self.last_event = {}
 
         # List of packages' metalinks
+        # (download plan, package identity -> metalink.PlanEntry)
         self.metalinks = None
 
+        # Mirror (scheme and host) -> position in rankmirrors result
+        self.mirror_positions = {}
+
+        # Download object (it may still be copying packages to xz_cache_dirs)
+        self.download = None
+
     def start_download(self, metalinks=None):
         """ Begin download """
         if metalinks:
@@ -100,48 +120,96 @@ class DownloadPackages():
             txt = _("Can't create download package list.")
             raise misc.InstallError(txt)
 
-        proxies = self.settings.get("proxies")
+        self.download = self.create_download()
 
-        download = download_requests.Download(
-            self.pacman_cache_dir,
-            self.xz_cache_dirs,
-            self.events.queue,
-            proxies)
-
-        if not download.start(self.metalinks):
+        if not self.download.start(self.metalinks):
             # When we can't download (even one package), we stop right here
             txt = _("Can't download needed packages. Cnchi can't continue.")
             raise misc.InstallError(txt)
 
+    def create_download(self):
+        """ Creates the download object of the chosen backend ('requests'
+            or 'aria2'). Falls back to requests if aria2c is not available """
+        proxies = self.settings.get("proxies")
+        max_workers = self.settings.get("download_workers")
+        backend = self.settings.get("download_backend")
+
+        down = None
+        if backend == 'aria2':
+            aria2_conf = os.path.join(self.settings.get('data'), 'powerpill.json')
+            if download_aria2.is_available(aria2_conf):
+                down = download_aria2.Download(
+                    self.pacman_cache_dir,
+                    self.xz_cache_dirs,
+                    self.events.queue,
+                    proxies,
+                    max_workers,
+                    self.staging_dirs,
+                    aria2_conf)
+            else:
+                logging.warning(
+                    "aria2c is not available, packages will be downloaded using requests")
+        elif backend != 'requests':
+            logging.warning("Unknown download backend '%s', using requests", backend)
+
+        if down is None:
+            down = download_requests.Download(
+                self.pacman_cache_dir,
+                self.xz_cache_dirs,
+                self.events.queue,
+                proxies,
+                max_workers,
+                self.staging_dirs)
+
+        # Packages missing in LAN caches must not quarantine them
+        for lan_mirror in self.lan_mirrors:
+            down.mirrors.add_cache_host(lan_mirror)
+
+        return down
+
+    def wait_cache_writes(self):
+        """ Waits until downloaded packages are copied to xz_cache_dirs """
+        if self.download:
+            self.download.wait_cache_writes()
+
     def url_sort_helper(self, url):
         """ helper method for sorting mirror urls """
         if not url:
             return 9999
-        # Use the mirrorlist we created earlier to determine a url's priority
-        ranked = self.settings.get('rankmirrors_result')
         # Use the first part of the URL to find its position in the ranked mirror list
         partial = '/'.join(url.split('/')[:3])
-        position = [i for i, s in enumerate(ranked) if partial in s] or [9999]
-        return position[0]
-
-    def add_metalink_info(self, metalink):
-        """ Adds metalink info to metalinks list """
-        # Get metalink info
-        metalink_info = ml.get_info(metalink)
-
-        # Update downloads list with the new info from
-        # the processed metalink
-        for key in metalink_info:
+        if partial not in self.mirror_positions:
+            # Use the mirrorlist we created earlier to determine a url's priority
+            ranked = self.settings.get('rankmirrors_result')
+            position = [i for i, s in enumerate(ranked) if partial in s] or [9999]
+            self.mirror_positions[partial] = position[0]
+        return self.mirror_positions[partial]
+
+    def add_plan(self, plan):
+        """ Adds download plan entries (see metalink.create_plan) to
+            metalinks list """
+        for key, entry in plan.items():
             if key not in self.metalinks:
-                self.metalinks[key] = metalink_info[key]
-                urls = metalink_info[key]['urls']
+                self.metalinks[key] = entry
                 if self.settings:
                     # Sort urls based on the rankmirrors mirrorlist
-                    sorted_urls = sorted(urls, key=self.url_sort_helper)
-                    self.metalinks[key]['urls'] = sorted_urls
-                else:
-                    # When testing, settings is not available
-                    self.metalinks[key]['urls'] = urls
+                    entry.urls = sorted(entry.urls, key=self.url_sort_helper)
+                if self.lan_mirrors:
+                    # LAN package caches go first (hashes are checked anyway)
+                    entry.urls = [
+                        lan_mirror + entry.filename
+                        for lan_mirror in self.lan_mirrors] + entry.urls
+
+    def create_transaction_metalinks(self, pacman):
+        """ Creates the downloads list from a prepared (download only) alpm
+            transaction of pacman (a pac.Pac object), so every file alpm
+            will need when installing is downloaded beforehand """
+        plan = ml.create_transaction_plan(pacman, self.package_names)
+        if plan is None:
+            return False
+        self.metalinks = {}
+        self.add_plan(plan)
+        return True
 
     @misc.raise_privileges
     def create_metalinks_list(self):
@@ -150,13 +218,10 @@ class DownloadPackages():
         self.events.add('percent', 0)
         self.events.add(
             'info', _('Creating the list of packages to download...'))
-        processed_packages = 0
-        total_packages = len(self.package_names)
-
         self.metalinks = {}
 
         try:
-            pacman = pac.Pac(
+            pacman = pac.Pac.get_session(
                 conf_path=self.pacman_conf_file,
                 callback_queue=self.events.queue)
             if pacman is None:
@@ -170,25 +235,19 @@ class DownloadPackages():
             return False
 
         try:
-            for package_name in self.package_names:
-                metalink = ml.create(pacman, package_name,
-                                     self.pacman_conf_file)
-                if metalink is None:
-                    txt = "Error creating metalink for package %s. Installation will stop"
-                    logging.error(txt, package_name)
-                    txt = _("Error creating metalink for package {}. "
-                            "Installation will stop").format(package_name)
-                    raise misc.InstallError(txt)
-
-                self.add_metalink_info(metalink)
-
-                # Show progress to the user
-                processed_packages += 1
-                percent = round(float(processed_packages / total_packages), 2)
-                self.events.add('percent', percent)
-
-            pacman.release()
-            del pacman
+            # Resolve all packages (and their dependencies) at once
+            plan = ml.create_plan(pacman, self.package_names, self.pacman_conf_file)
+            if plan is None:
+                txt = "Error creating metalink for packages %s. Installation will stop"
+                logging.error(txt, ', '.join(self.package_names))
+                txt = _("Error creating the list of packages to download. "
+                        "Installation will stop")
+                raise misc.InstallError(txt)
+
+            self.add_plan(plan)
+
+            # Show progress to the user
+            self.events.add('percent', 1)
         except (KeyError, pyalpm.error) as ex:
             template = "Can't create download set. " \
                 "An exception of type {0} occured. Arguments:\n{1!r}"
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# download_aria2.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Module to download packages using aria2c """
+
+import json
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import tempfile
+
+import requests
+
+try:
+    import download.download_requests as download_requests
+    import download.metalink as ml
+except ModuleNotFoundError:
+    import download_requests
+    import metalink as ml
+
+
+def load_aria2_conf(conf_path):
+    """ Reads aria2c path and arguments from powerpill's config file """
+    conf = {}
+    if not conf_path:
+        return Download.ARIA2C_PATH, []
+    try:
+        with open(conf_path, 'r') as conf_file:
+            conf = json.load(conf_file).get('aria2', {})
+    except (OSError, ValueError) as err:
+        logging.debug("Can't read %s: %s", conf_path, err)
+    path = conf.get('path', Download.ARIA2C_PATH)
+    args = conf.get('args', [])
+    return path, args
+
+
+def is_available(conf_path):
+    """ Checks if aria2c is installed """
+    path, _args = load_aria2_conf(conf_path)
+    return os.path.isfile(path) and os.access(path, os.X_OK)
+
+
+class Download(download_requests.Download):
+    """ Downloads packages using aria2c. Packages are still looked for in
+        the cache dirs first, the rest are written to a metalink file that
+        is given to aria2c. Progress is read using aria2c's JSON-RPC interface.
+        Packages that aria2c can't download are tried again using requests """
+
+    ARIA2C_PATH = '/usr/bin/aria2c'
+
+    # Seconds between progress updates
+    POLL_INTERVAL = 0.5
+
+    # Seconds to wait for aria2c to start (or to quit)
+    RPC_TIMEOUT = 10
+
+    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue, proxies=None,
+                 max_workers=download_requests.Download.DEFAULT_MAX_WORKERS,
+                 staging_dirs=None, aria2_conf=None):
+        super().__init__(
+            pacman_cache_dir, xz_cache_dirs, callback_queue, proxies,
+            max_workers, staging_dirs)
+        self.aria2c_path, self.aria2c_args = load_aria2_conf(aria2_conf)
+        self.rpc_url = None
+        self.rpc_secret = None
+        self.rpc_session = None
+        # Packages aria2c has downloaded
+        self.fetched = set()
+
+    def start(self, downloads):
+        """ Gets all packages. Returns False if one can't be downloaded """
+        elements = self.prepare(downloads)
+        self.fetched = set()
+
+        pending = []
+        for element in elements:
+            dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
+            if self.get_cached_element(element, dst_path):
+                self.progress.finish(element)
+            else:
+                pending.append(element)
+
+        if pending:
+            logging.debug(
+                "Downloading %d packages to pacman cache dir '%s' using aria2c",
+                len(pending), self.pacman_cache_dir)
+            try:
+                self.run_aria2c(pending)
+            except (OSError, ValueError, subprocess.SubprocessError) as err:
+                logging.warning("Error running aria2c: %s", err)
+
+        missing = [
+            element for element in pending
+            if element['filename'] not in self.fetched]
+        if missing and not self.stop_event.is_set():
+            logging.warning(
+                "aria2c could not download %d packages, trying again without it",
+                len(missing))
+            self.run_workers(missing)
+
+        return self.finish()
+
+    def get_aria2c_command(self, meta4_path, port):
+        """ Returns aria2c command line """
+        cmd = [self.aria2c_path] + list(self.aria2c_args)
+        cmd.extend([
+            '--dir=' + self.pacman_cache_dir,
+            '--metalink-file=' + meta4_path,
+            '--enable-rpc=true',
+            '--rpc-listen-all=false',
+            '--rpc-listen-port={0}'.format(port),
+            '--rpc-secret=' + self.rpc_secret])
+        if self.proxies:
+            for protocol in ('http', 'https', 'ftp'):
+                if self.proxies.get(protocol):
+                    cmd.append('--{0}-proxy={1}'.format(protocol, self.proxies[protocol]))
+        return cmd
+
+    @staticmethod
+    def get_free_port():
+        """ Asks the kernel for a free tcp port """
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def rpc_call(self, method, *params):
+        """ Calls an aria2c JSON-RPC method and returns its result """
+        data = {
+            'jsonrpc': '2.0',
+            'id': 'cnchi',
+            'method': method,
+            'params': ['token:' + self.rpc_secret] + list(params)}
+        req = self.rpc_session.post(self.rpc_url, json=data, timeout=Download.RPC_TIMEOUT)
+        reply = req.json()
+        if 'error' in reply:
+            raise OSError("aria2c {0} failed: {1}".format(method, reply['error']))
+        return reply.get('result')
+
+    def wait_rpc(self, process):
+        """ Waits until aria2c answers our calls """
+        for _attempt in range(int(Download.RPC_TIMEOUT / Download.POLL_INTERVAL)):
+            if process.poll() is not None:
+                raise OSError("aria2c exited with code {0}".format(process.returncode))
+            try:
+                return self.rpc_call('aria2.getVersion')
+            except requests.exceptions.ConnectionError:
+                if self.stop_event.wait(Download.POLL_INTERVAL):
+                    break
+        raise OSError("aria2c is not answering")
+
+    def run_aria2c(self, elements):
+        """ Downloads elements using aria2c """
+        metalink = ml.Metalink()
+        for element in elements:
+            metalink.add_element(element)
+
+        meta4_fd, meta4_path = tempfile.mkstemp(prefix='cnchi-', suffix='.meta4')
+        with os.fdopen(meta4_fd, 'w') as meta4_file:
+            meta4_file.write(str(metalink))
+
+        port = self.get_free_port()
+        self.rpc_url = 'http://127.0.0.1:{0}/jsonrpc'.format(port)
+        self.rpc_secret = secrets.token_hex(16)
+        self.rpc_session = requests.Session()
+        # Do not send local rpc calls through the user's proxy
+        self.rpc_session.trust_env = False
+
+        process = subprocess.Popen(
+            self.get_aria2c_command(meta4_path, port),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        try:
+            version = self.wait_rpc(process)
+            logging.debug("Using aria2c %s", version.get('version'))
+            self.watch_aria2c(elements, process)
+        finally:
+            try:
+                self.rpc_call('aria2.forceShutdown')
+            except (OSError, ValueError, requests.exceptions.RequestException):
+                pass
+            try:
+                process.wait(timeout=Download.RPC_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            self.rpc_session.close()
+            os.remove(meta4_path)
+
+    def watch_aria2c(self, elements, process):
+        """ Maps aria2c progress to our events until all downloads stop
+            (or aria2c has nothing to download, for instance because it
+            could not read our metalink) """
+        by_filename = {element['filename']: element for element in elements}
+        # filename -> bytes downloaded (to compute throughput)
+        completed = {}
+        finished = set()
+        keys = ['gid', 'status', 'files', 'completedLength', 'errorMessage']
+
+        while not self.stop_event.wait(Download.POLL_INTERVAL):
+            if process.poll() is not None:
+                raise OSError("aria2c exited with code {0}".format(process.returncode))
+
+            for status in self.rpc_call('aria2.tellActive', keys):
+                filename = self.get_status_filename(status)
+                if filename not in by_filename:
+                    continue
+                if filename not in completed:
+                    self.show_fetching(by_filename[filename])
+                length = int(status.get('completedLength', 0))
+                transferred = max(0, length - completed.get(filename, 0))
+                completed[filename] = length
+                self.progress.update(filename, length, transferred)
+
+            # Ask for the global stats before the stopped downloads, so a
+            # download that stops in between is not missed when we quit
+            stats = self.rpc_call('aria2.getGlobalStat')
+
+            stopped = self.rpc_call('aria2.tellStopped', 0, len(elements), keys)
+            for status in stopped:
+                filename = self.get_status_filename(status)
+                if filename not in by_filename or status['gid'] in finished:
+                    continue
+                finished.add(status['gid'])
+                self.finish_element(by_filename[filename], status)
+
+            if int(stats['numActive']) == 0 and int(stats['numWaiting']) == 0:
+                if int(stats['numStoppedTotal']) == 0:
+                    logging.warning("aria2c has nothing to download")
+                break
+
+    @staticmethod
+    def get_status_filename(status):
+        """ Returns the name of the file being downloaded """
+        files = status.get('files') or [{}]
+        return os.path.basename(files[0].get('path', ''))
+
+    def finish_element(self, element, status):
+        """ aria2c has stopped downloading element """
+        dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
+        if status.get('status') != 'complete':
+            logging.warning(
+                "aria2c could not download %s: %s",
+                element['filename'], status.get('errorMessage'))
+            return
+        if not self.pacman_cache_index.check_hash(dst_path, element):
+            try:
+                os.remove(dst_path)
+            except OSError:
+                pass
+            return
+        self.pacman_cache_index.add(element['filename'])
+        self.fetched.add(element['filename'])
+        self.cache_writer.add(dst_path)
+        self.progress.finish(element)
@@ -33,10 +33,23 @@ import hashlib
 import logging
 import os
 
+# Files are hashed reading blocks of this size
+BLOCK_SIZE = 1024 * 1024
+
+
 def check_hash(path, element, queue_event=None):
     """ Checks file hash (sha256 or md5) """
     # Note: path must exist!
+    hash_type, _expected = get_expected_hash(element)
+    digest = None
+    if hash_type:
+        digest = get_file_hash(path, hash_type)
+    return check_digest(element, hash_type, digest, path, queue_event)
+
 
+def check_digest(element, hash_type, digest, path, queue_event=None):
+    """ Compares an already computed digest (hash_type is sha256 or md5)
+        with the one stored in the metalink element """
     identity = element['identity']
     filename = element['filename']
 
@@ -45,7 +58,7 @@ def check_hash(path, element, queue_event=None):
 
     # Check sha256 if available
     if sha256:
-        if sha256 != get_file_hash(path, 'sha256'):
+        if hash_type != 'sha256' or sha256 != digest:
             logging.warning("SHA256 hash of file %s does not match!", filename)
             return False
         logging.debug("SHA256 hash of %s is OK.", path)
@@ -56,7 +69,7 @@ def check_hash(path, element, queue_event=None):
 
     # sha256 not available let's check md5
     if md5:
-        if md5 != get_file_hash(path, 'md5'):
+        if hash_type != 'md5' or md5 != digest:
             logging.warning("MD5 hash of file %s does not match!", filename)
             return False
         logging.debug("MD5 hash of %s is OK.", path)
@@ -71,23 +84,42 @@ def check_hash(path, element, queue_event=None):
         queue_event('cache_pkgs_md5_check_failed', identity)
     return True
 
-def get_file_hash(path, hash_type):
-    """ Gets md5 or sha256 hash from a file """
 
-    if not os.path.exists(path):
-        return None
+def get_expected_hash(element):
+    """ Returns the hash type that should be checked for this element
+        (sha256 or, as fallback, md5) and its value """
+    for hash_type in ('sha256', 'md5'):
+        hash_value = get_element_hash(element, hash_type)
+        if hash_value:
+            return hash_type, hash_value
+    return None, None
 
+
+def new_hash(hash_type):
+    """ Creates a hash object (md5 or sha256) """
     if hash_type == 'md5':
-        myhash = hashlib.md5()
-    else:
-        myhash = hashlib.sha256()
+        return hashlib.md5()
+    return hashlib.sha256()
+
 
+def update_hash(myhash, path):
+    """ Feeds path contents to myhash, reading fixed size blocks """
     with open(path, 'rb') as myfile:
-        for line in myfile:
-            myhash.update(line)
+        for block in iter(lambda: myfile.read(BLOCK_SIZE), b''):
+            myhash.update(block)
 
+
+def get_file_hash(path, hash_type):
+    """ Gets md5 or sha256 hash from a file """
+
+    if not os.path.exists(path):
+        return None
+
+    myhash = new_hash(hash_type)
+    update_hash(myhash, path)
     return myhash.hexdigest()
 
+
 def get_element_hash(element, hash_type):
     """ Get hash from one metalink element """
     hash_value = None
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# download_progress.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Aggregated download progress (bytes, throughput and ETA) """
+
+import threading
+import time
+
+
+def get_element_size(element):
+    """ Returns package size stored in a metalink element (0 if unknown) """
+    try:
+        return int(element.get('size'))
+    except (TypeError, ValueError):
+        return 0
+
+
+class DownloadProgress():
+    """ Keeps track of the bytes downloaded by all workers and issues these
+        events (at most once every EVENT_INTERVAL seconds):
+            downloads_percent: downloaded bytes / total bytes
+            downloads_bytes: (downloaded bytes, total bytes)
+            downloads_speed: smoothed throughput (bytes per second)
+            downloads_eta: estimated seconds left (-1 if unknown) """
+
+    EVENT_INTERVAL = 0.5
+
+    # Weight of the last measure in the smoothed throughput
+    SMOOTHING = 0.3
+
+    def __init__(self, events, elements):
+        self.events = events
+        self.lock = threading.Lock()
+
+        self.total_files = len(elements)
+        self.total_bytes = sum(get_element_size(element) for element in elements)
+
+        # Bytes of finished files
+        self.completed_bytes = 0
+        self.completed_files = 0
+        # filename -> bytes we have of files being downloaded
+        self.in_flight = {}
+
+        # Bytes really received from the network (to measure speed)
+        self.transferred = 0
+        self.last_transferred = 0
+        self.last_time = time.monotonic()
+        self.speed = None
+
+    def update(self, filename, file_bytes, transferred=0):
+        """ We have file_bytes of filename (transferred of them are new) """
+        with self.lock:
+            self.in_flight[filename] = file_bytes
+            self.transferred += transferred
+        self.report()
+
+    def finish(self, element):
+        """ Element has been downloaded (or found in a cache) """
+        with self.lock:
+            self.in_flight.pop(element['filename'], None)
+            self.completed_bytes += get_element_size(element)
+            self.completed_files += 1
+        self.report(force=True)
+
+    def get_done_bytes(self):
+        """ Bytes we already have (must be called with lock held) """
+        done = self.completed_bytes + sum(self.in_flight.values())
+        return min(done, self.total_bytes)
+
+    def report(self, force=False):
+        """ Issues progress events """
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.last_time
+            if elapsed < DownloadProgress.EVENT_INTERVAL and not force:
+                return
+
+            if elapsed > 0:
+                speed = (self.transferred - self.last_transferred) / elapsed
+                if self.speed is None:
+                    self.speed = speed
+                else:
+                    self.speed = (DownloadProgress.SMOOTHING * speed +
+                                  (1 - DownloadProgress.SMOOTHING) * self.speed)
+                self.last_transferred = self.transferred
+                self.last_time = now
+
+            done = self.get_done_bytes()
+            if self.total_bytes > 0:
+                percent = done / self.total_bytes
+            elif self.total_files > 0:
+                percent = self.completed_files / self.total_files
+            else:
+                percent = 1.0
+
+            eta = -1
+            if self.speed and self.total_bytes > 0:
+                eta = int((self.total_bytes - done) / self.speed)
+
+            speed = int(self.speed or 0)
+
+        self.events.add('downloads_percent', str(round(percent, 2)))
+        self.events.add('downloads_bytes', (done, self.total_bytes))
+        self.events.add('downloads_speed', speed)
+        self.events.add('downloads_eta', eta)
@@ -31,10 +31,10 @@
 
 import os
 import logging
-import shutil
 import time
 import socket
 import io
+import queue
 import threading
 
 import requests
@@ -43,8 +43,18 @@ from misc.events import Events
 
 try:
     import download.download_hash as dhash
+    from download.cache_copy import CacheWriter, fast_copy, move_file
+    from download.cache_index import CacheIndex
+    from download.download_progress import DownloadProgress, get_element_size
+    from download.download_segmented import SegmentedDownload
+    from download.mirror_health import MirrorHealth
 except ModuleNotFoundError:
     import download_hash as dhash
+    from cache_copy import CacheWriter, fast_copy, move_file
+    from cache_index import CacheIndex
+    from download_progress import DownloadProgress, get_element_size
+    from download_segmented import SegmentedDownload
+    from mirror_health import MirrorHealth
 
 # When testing, no _() is available
 try:
@@ -53,40 +63,30 @@ except NameError as err:
     def _(message):
         return message
 
-class CopyToCache(threading.Thread):
-    ''' Class thread to copy a xz file to the user's
-        provided cache directory '''
-
-    PACMAN_ISO_CACHE = "/var/cache/pacman/pkg"
-
-    def __init__(self, origin, xz_cache_dirs):
-        threading.Thread.__init__(self)
-        self.origin = origin
-        self.xz_cache_dirs = xz_cache_dirs
-
-    def run(self):
-        basename = os.path.basename(self.origin)
-        for xz_cache_dir in self.xz_cache_dirs:
-            # Avoid using the ISO itself
-            if xz_cache_dir != CopyToCache.PACMAN_ISO_CACHE:
-                dst = os.path.join(xz_cache_dir, basename)
-                # Try to copy the file, do not worry if it's not possible
-                try:
-                    shutil.copy(self.origin, dst)
-                except (FileNotFoundError, FileExistsError, OSError):
-                    pass
-
-
 class Download():
     """ Class to download packages using requests
         This class tries to previously download all necessary packages for
         Antergos installation using requests """
 
-    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue, proxies=None):
-        """ Initialize Download class. Gets default configuration """
+    # Number of packages that are downloaded at the same time
+    DEFAULT_MAX_WORKERS = 6
+
+    # Partially downloaded files are stored with this suffix
+    PART_SUFFIX = '.part'
+
+    # How many times an interrupted download can be resumed
+    MAX_RESUMES = 5
+
+    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue, proxies=None,
+                 max_workers=DEFAULT_MAX_WORKERS, staging_dirs=None):
+        """ Initialize Download class. Gets default configuration.
+            Packages found in staging_dirs are moved (not copied) to
+            pacman_cache_dir """
         self.pacman_cache_dir = pacman_cache_dir
         self.xz_cache_dirs = xz_cache_dirs
+        self.staging_dirs = staging_dirs or []
         self.proxies = proxies
+        self.max_workers = max(1, max_workers or Download.DEFAULT_MAX_WORKERS)
 
         self.events = Events(callback_queue)
 
@@ -99,105 +99,225 @@ class Download():
         # Stores last issued event (to prevent repeating events)
         self.last_event = {}
 
-        self.copy_to_cache_threads = []
+        # Copies downloaded packages to the user's cache dirs
+        self.cache_writer = CacheWriter(self.xz_cache_dirs)
+
+        # Shared between worker threads
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.started = 0
+        self.total_downloads = 0
+        self.progress = None
 
+        # Each worker thread keeps its own requests session (keep-alive)
+        self.local = threading.local()
+
+        # Shared mirror scoreboard (failures, timeouts and throughput)
+        self.mirrors = MirrorHealth()
+
+        # Cache directories contents and already verified hashes
+        self.pacman_cache_index = None
+        self.xz_cache_indexes = []
+        self.staging_indexes = []
+
+        # Store hashes of the downloaded packages (used by staging downloads)
+        self.store_hashes = False
 
     def start(self, downloads):
-        """ Downloads using requests """
-        downloaded = 0
-        total_downloads = len(downloads)
+        """ Downloads using requests. Several packages are downloaded at the
+            same time (up to max_workers), biggest ones first so no worker
+            is left downloading a big package alone at the end. Stops on the
+            first package that can't be downloaded from any of its mirrors. """
+        elements = self.prepare(downloads)
+
+        logging.debug(
+            "Downloading packages to pacman cache dir '%s' (%d at a time)",
+            self.pacman_cache_dir,
+            self.max_workers)
+
+        self.run_workers(elements)
+        return self.finish()
+
+    def prepare(self, downloads):
+        """ Indexes cache dirs and prepares progress report. Returns the
+            packages to download, sorted by size (biggest first) """
+        self.started = 0
+        self.total_downloads = len(downloads)
+        self.stop_event.clear()
+
+        # Do not store hashes of the destination cache (it will be part
+        # of the installed system), but do it for the user's caches
+        self.pacman_cache_index = CacheIndex(
+            self.pacman_cache_dir, persistent=self.store_hashes)
+        self.xz_cache_indexes = [
+            CacheIndex(xz_cache_dir) for xz_cache_dir in self.xz_cache_dirs
+            if os.path.isdir(xz_cache_dir)]
+        self.staging_indexes = [
+            CacheIndex(staging_dir) for staging_dir in self.staging_dirs
+            if os.path.isdir(staging_dir)]
 
         self.events.add('downloads_progress_bar', 'show')
         self.events.add('downloads_percent', '0')
 
-        self.copy_to_cache_threads = []
+        elements = sorted(downloads.values(), key=get_element_size, reverse=True)
+        self.progress = DownloadProgress(self.events, elements)
+        return elements
+
+    def run_workers(self, elements):
+        """ Gets elements using up to max_workers threads """
+        pending = queue.Queue()
+        for element in elements:
+            pending.put(element)
+
+        workers = []
+        for _index in range(min(self.max_workers, len(elements))):
+            worker = threading.Thread(target=self.worker, args=(pending,))
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
+
+    def finish(self):
+        """ Stores verified hashes. Returns False if a package could not
+            be downloaded """
+        for xz_cache_index in self.xz_cache_indexes:
+            xz_cache_index.save()
+        self.pacman_cache_index.save()
+
+        if self.stop_event.is_set():
+            return False
 
-        logging.debug(
-            "Downloading packages to pacman cache dir '%s'",
-            self.pacman_cache_dir)
+        self.events.add('downloads_progress_bar', 'hide')
+        return True
 
-        while downloads:
-            needs_to_download = True
+    def wait_cache_writes(self):
+        """ Waits until all downloaded packages are also copied to the
+            provided cache dirs (if any). Copies go on in the background
+            until this is called, even while pacman installs the packages. """
+        self.cache_writer.join()
+
+    def worker(self, pending):
+        """ Worker thread. Takes packages from the pending queue until it is
+            empty or another worker fails """
+        while not self.stop_event.is_set():
+            try:
+                element = pending.get_nowait()
+            except queue.Empty:
+                break
 
-            # Get package to download from downloads list
-            _identity, element = downloads.popitem()
+            try:
+                got_element = self.get_element(element)
+            except Exception as err:
+                # Do not let the thread die silently (start() must fail)
+                logging.error("Can't get %s: %s", element['filename'], err)
+                self.stop_event.set()
+                break
 
-            self.events.add('percent', 0)
+            if not got_element:
+                if not self.stop_event.is_set():
+                    # None of the mirror urls works.
+                    # Stop right here, so the user does not have to wait
+                    # to download the other packages.
+                    logging.error(
+                        "Can't download %s, even after trying all available mirrors",
+                        element['filename'])
+                    self.stop_event.set()
+                break
+
+            self.events.add('progress_bar_show_text', '')
+            self.progress.finish(element)
 
+    def get_session(self):
+        """ Returns the requests session of the calling thread """
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            if self.proxies:
+                session.proxies.update(self.proxies)
+            self.local.session = session
+        return session
+
+    def get_element(self, element):
+        """ Gets one package, from a cache directory if possible or
+            downloading it if not. Returns False on failure """
+        self.show_fetching(element)
+        dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
+        if self.get_cached_element(element, dst_path):
+            return True
+        return self.download_package(element, dst_path)
+
+    def show_fetching(self, element):
+        """ Tells the user which package we are getting """
+        with self.lock:
+            self.started += 1
             txt = _("Fetching {0} {1} ({2}/{3})...").format(
                 element['identity'],
                 element['version'],
-                downloaded + 1,
-                total_downloads)
-            self.events.add('info', txt)
-
-            dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
-
-            if os.path.exists(dst_path):
-                # File already exists in destination pacman's cache
-                # (previous install?). We check the file hash.
-                if not dhash.check_hash(dst_path, element):
-                    # We're sure it's a wrong hash. Force to download it
-                    needs_to_download = True
-                else:
-                    needs_to_download = False
+                self.started,
+                self.total_downloads)
+        self.events.add('percent', 0)
+        self.events.add('info', txt)
+
+    def get_cached_element(self, element, dst_path):
+        """ Looks for element in the destination pacman cache, in the staging
+            dirs and in the user's cache dirs (in this order). Returns True if
+            element is now in the destination pacman cache """
+        if self.pacman_cache_index.get_path(element['filename']):
+            # File already exists in destination pacman's cache
+            # (previous install?). We check the file hash.
+            if self.pacman_cache_index.check_hash(dst_path, element):
+                logging.debug(
+                    "File %s found in %s cache, there is no need to download it",
+                    element['filename'],
+                    self.pacman_cache_dir)
+                return True
+            # We're sure it's a wrong hash. Force to download it
+
+        # Packages downloaded in advance (while formatting)
+        for staging_index in self.staging_indexes:
+            staging_path = staging_index.get_path(element['filename'])
+            if staging_path and staging_index.check_hash(staging_path, element):
+                try:
+                    move_file(staging_path, dst_path)
                     logging.debug(
-                        "File %s found in %s cache, there is no need to download it",
+                        "%s was already downloaded to %s",
                         element['filename'],
-                        self.pacman_cache_dir)
-            else:
-                needs_to_download = True
-                # Check all cache directories
-                for xz_cache_dir in self.xz_cache_dirs:
-                    dst_xz_cache_path = os.path.join(
-                        xz_cache_dir,
-                        element['filename'])
-
-                    if (os.path.exists(dst_xz_cache_path) and
-                            dhash.check_hash(dst_xz_cache_path, element)):
-                        # We're lucky, the package is already downloaded
-                        # in the cache the user has given us
-                        # and its hash checks out
-                        try:
-                            shutil.copy(dst_xz_cache_path, dst_path)
-                            needs_to_download = False
-                            logging.debug(
-                                "%s found in %s cache, there is no need to download it",
-                                element['filename'],
-                                xz_cache_dir)
-                            # Get out of the cache for loop, as we managed
-                            # to find the package in this cache directory
-                            break
-                        except OSError as os_error:
-                            needs_to_download = True
-                            logging.debug(
-                                "Error copying %s to %s : %s",
-                                dst_xz_cache_path,
-                                dst_path,
-                                os_error)
-
-            if needs_to_download and not self.download_package(element, dst_path):
-                # None of the mirror urls works.
-                # Stop right here, so the user does not have to wait
-                # to download the other packages.
-                logging.error(
-                    "Can't download %s, even after trying all available mirrors",
-                    element['filename'])
-                return False
-
-            downloaded += 1
-
-            self.events.add('progress_bar_show_text', '')
-
-            downloads_percent = round(float(downloaded / total_downloads), 2)
-            self.events.add('downloads_percent', str(downloads_percent))
-
-        # Wait until all xz packages are also copied to provided cache (if any)
-        for copy_to_cache_thread in self.copy_to_cache_threads:
-            copy_to_cache_thread.join()
+                        staging_index.cache_dir)
+                    self.cache_writer.add(dst_path)
+                    return True
+                except OSError as os_error:
+                    logging.debug(
+                        "Error moving %s to %s : %s",
+                        staging_path,
+                        dst_path,
+                        os_error)
+
+        # Check all cache directories
+        for xz_cache_index in self.xz_cache_indexes:
+            dst_xz_cache_path = xz_cache_index.get_path(element['filename'])
+
+            if (dst_xz_cache_path and dst_xz_cache_path != dst_path and
+                    xz_cache_index.check_hash(dst_xz_cache_path, element)):
+                # We're lucky, the package is already downloaded
+                # in the cache the user has given us
+                # and its hash checks out
+                try:
+                    method = fast_copy(dst_xz_cache_path, dst_path)
+                    logging.debug(
+                        "%s found in %s cache, there is no need to download it (%s)",
+                        element['filename'],
+                        xz_cache_index.cache_dir,
+                        method)
+                    return True
+                except OSError as os_error:
+                    logging.debug(
+                        "Error copying %s to %s : %s",
+                        dst_xz_cache_path,
+                        dst_path,
+                        os_error)
 
-        self.events.add('downloads_progress_bar', 'hide')
-        return True
+        return False
 
     def download_package(self, element, dst_path):
         """ Package wasn't previously downloaded or its md5 was wrong
@@ -211,94 +331,261 @@ class Download():
             element['version'],
             len(element['urls']))
 
-        for url in element['urls']:
-            # Let's catch empty values as well as None just to be safe
-            if not url:
-                # Something bad has happened, let's try another mirror
-                download_ok = False
-                logging.debug(
-                    "Package %s-%s has an empty url for this mirror",
-                    element['identity'],
-                    element['version'])
-            else:
-                download_ok = self.download_url(url, dst_path, element)
+        if len([url for url in element['urls'] if url]) < len(element['urls']):
+            logging.debug(
+                "Package %s-%s has empty urls for some mirrors",
+                element['identity'],
+                element['version'])
+
+        part_path = dst_path + Download.PART_SUFFIX
+        self.discard_stale_part(part_path, element)
+
+        download_ok = False
 
-            if download_ok:
-                # Copy downloaded xz file to the cache the user has provided, too.
-                copy_to_cache_thread = CopyToCache(dst_path, self.xz_cache_dirs)
-                copy_to_cache_thread.start()
-                self.copy_to_cache_threads.append(copy_to_cache_thread)
+        if SegmentedDownload.is_suitable(element) and not os.path.exists(part_path):
+            # Big package, download it from several mirrors at once
+            download_ok = SegmentedDownload(self, element, dst_path).start()
+            if self.stop_event.is_set():
+                return False
+            if not download_ok:
+                logging.debug(
+                    "Segmented download of %s failed, trying one mirror at a time",
+                    element['filename'])
 
-                # Get out of the for loop, as we managed
-                # to download the package
+        tried = set()
+        resumes = 0
+        while not download_ok:
+            # Mirrors are sorted again each time, as another worker may
+            # have found out that one of them is not working
+            urls = [url for url in self.mirrors.sort_urls(element['urls'])
+                    if url not in tried]
+            if not urls:
                 break
-            else:
+            url = urls[0]
+            tried.add(url)
+
+            # Wait if this mirror has failed recently (exponential backoff)
+            delay = self.mirrors.get_delay(url)
+            if delay > 0:
+                logging.debug("Waiting %.1f seconds before using %s", delay, url)
+            if self.stop_event.wait(delay):
+                # Another worker failed, do not bother
+                return False
+
+            part_size = self.get_file_size(part_path)
+
+            download_ok = self.download_url(url, dst_path, element)
+
+            if (not download_ok and resumes < Download.MAX_RESUMES and
+                    self.get_file_size(part_path) > part_size):
+                # The connection was lost but we got some data. This mirror
+                # can be used again to resume the download.
+                resumes += 1
+                tried.discard(url)
+
+            if not download_ok:
                 # requests failed to obtain the file. Wrong url?
                 msg = "Can't download %s, Cnchi will try another mirror."
                 logging.debug(msg, url)
-                # delays for 20 seconds
-                time.sleep(20)
+
+        if download_ok:
+            # Copy downloaded xz file to the cache the user has provided, too.
+            self.cache_writer.add(dst_path)
 
         return download_ok
 
+    def discard_stale_part(self, part_path, element=None):
+        """ Deletes a .part file that can't be resumed: one that is as big
+            as the package (an interrupted segmented download preallocates
+            the whole file). Returns its size (0 if deleted) """
+        part_size = self.get_file_size(part_path)
+        size = get_element_size(element) if element else 0
+        if part_size and size and part_size >= size:
+            logging.debug(
+                "%s can't be resumed, downloading it from scratch",
+                os.path.basename(part_path))
+            self.discard_part(part_path)
+            return 0
+        return part_size
+
+    def discard_part(self, part_path):
+        """ Deletes a .part file (and forgets its progress) """
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        filename = os.path.basename(part_path)[:-len(Download.PART_SUFFIX)]
+        self.progress.update(filename, 0)
+
+    @staticmethod
+    def get_file_size(path):
+        """ Returns file size (0 if it does not exist) """
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def get_range_start(content_range):
+        """ Returns the first byte position of a Content-Range header
+            (bytes 100-199/200) or None if it can't be parsed """
+        try:
+            unit, byte_range = content_range.split()
+            if unit != 'bytes':
+                return None
+            return int(byte_range.split('-')[0])
+        except (AttributeError, ValueError):
+            return None
+
     def download_url(self, url, dst_path, element=None):
-        """ Downloads file from url to dst_path and checks its md5 hash """
+        """ Downloads file from url to dst_path and checks its md5 hash.
+            Data is written to a .part file first. If that file already
+            exists (a previous try was interrupted) the download is resumed
+            using a Range request. """
         percent = 0
-        completed_length = 0
+        filename = os.path.basename(dst_path)
+        part_path = dst_path + Download.PART_SUFFIX
+        offset = self.discard_stale_part(part_path, element)
+        completed_length = offset
         start = time.perf_counter()
+
+        hash_type = myhash = None
+        if element:
+            hash_type, _expected = dhash.get_expected_hash(element)
+            if hash_type:
+                myhash = dhash.new_hash(hash_type)
+
         try:
+            headers = {}
+            if offset > 0:
+                headers['Range'] = 'bytes={}-'.format(offset)
+
             # By default, get waits five minutes before
             # issuing a timeout, which is too much.
-            if self.proxies:
-                req = requests.get(
-                    url,
-                    stream=True,
-                    timeout=30,
-                    proxies=self.proxies)
+            req = self.get_session().get(
+                url, stream=True, timeout=30, headers=headers)
+
+            if (offset > 0 and
+                    req.status_code == requests.codes.requested_range_not_satisfiable):
+                # Our .part file is not a prefix of this package (it is not
+                # the mirror's fault). Start again from the beginning.
+                req.close()
+                logging.debug("%s can't resume %s, starting from scratch", url, filename)
+                self.discard_part(part_path)
+                return self.download_url(url, dst_path, element)
+
+            if req.status_code == requests.codes.partial_content:
+                if self.get_range_start(req.headers.get('content-range')) != offset:
+                    logging.debug("%s returned a wrong range, discarding it", url)
+                    req.close()
+                    self.mirrors.record_failure(url)
+                    return False
+                logging.debug("Resuming download of %s from byte %d", url, offset)
+                mode = 'ab'
+                if myhash:
+                    # Hash the data we already have
+                    dhash.update_hash(myhash, part_path)
+            elif req.status_code == requests.codes.ok:
+                if offset > 0:
+                    logging.debug(
+                        "%s does not support resuming, starting from scratch", url)
+                offset = 0
+                completed_length = 0
+                mode = 'wb'
             else:
-                req = requests.get(
-                    url,
-                    stream=True,
-                    timeout=30)
+                logging.debug("%s returned HTTP status %d", url, req.status_code)
+                req.close()
+                if req.status_code == requests.codes.not_found:
+                    self.mirrors.record_missing(url)
+                else:
+                    self.mirrors.record_failure(url)
+                return False
 
-            if req.status_code == requests.codes.ok:
-                # Get total file length
-                try:
-                    total_length = int(req.headers.get('content-length'))
-                except TypeError:
-                    total_length = 0
-                    logging.debug(
-                        "Metalink for package %s has no size info", url)
-
-                with open(dst_path, 'wb') as xz_file:
-                    for data in req.iter_content(io.DEFAULT_BUFFER_SIZE):
-                        if not data:
-                            break
-                        xz_file.write(data)
-                        completed_length += len(data)
-                        old_percent = percent
-                        if total_length > 0:
-                            percent = float(completed_length / total_length)
-                            percent = round(percent, 2)
-                        else:
-                            percent += 0.1
-                        if old_percent != percent:
-                            self.events.add('percent', percent)
-                        bps = completed_length // (time.perf_counter() - start)
-                        msg = self.format_progress_message(percent, bps)
-                        self.events.add('progress_bar_show_text', msg)
-
-                # Check hash of downloaded package
-                if element and not dhash.check_hash(dst_path, element):
-                    # Wrong hash! Force to download the file again
-                    return False
+            if req.headers.get('accept-ranges', 'none') == 'none':
+                logging.debug("%s does not accept byte ranges", url)
+
+            # Get total file length
+            try:
+                total_length = int(req.headers.get('content-length')) + offset
+            except TypeError:
+                total_length = 0
+                logging.debug(
+                    "Metalink for package %s has no size info", url)
+
+            with open(part_path, mode) as xz_file:
+                for data in req.iter_content(io.DEFAULT_BUFFER_SIZE):
+                    if not data:
+                        break
+                    if self.stop_event.is_set():
+                        # Another worker failed, stop downloading
+                        req.close()
+                        return False
+                    xz_file.write(data)
+                    if myhash:
+                        myhash.update(data)
+                    completed_length += len(data)
+                    self.progress.update(filename, completed_length, len(data))
+                    old_percent = percent
+                    if total_length > 0:
+                        percent = float(completed_length / total_length)
+                        percent = round(percent, 2)
+                    else:
+                        percent += 0.1
+                    if old_percent != percent:
+                        self.events.add('percent', percent)
+                    bps = (completed_length - offset) // (time.perf_counter() - start)
+                    msg = self.format_progress_message(percent, bps)
+                    self.events.add('progress_bar_show_text', msg)
         except (socket.timeout,
-                requests.exceptions.Timeout,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.ChunkedEncodingError) as connection_error:
+                requests.exceptions.Timeout) as timeout_error:
+            logging.debug(timeout_error)
+            self.mirrors.record_failure(url, timeout=True)
+            return False
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.InvalidSchema) as connection_error:
+            # InvalidSchema: file:// urls of offline bundles (packages missing
+            # from the bundle can't be downloaded)
             logging.debug(connection_error)
+            self.mirrors.record_failure(url)
+            return False
+
+        digest = myhash.hexdigest() if myhash else None
+        return self.finish_part(
+            url, part_path, dst_path, element, completed_length - offset, start,
+            hash_type, digest)
+
+    def finish_part(self, url, part_path, dst_path, element, downloaded, start,
+                    hash_type=None, digest=None):
+        """ Checks the hash of a completely downloaded .part file and
+            renames it to its final name. url can be None if the file
+            was downloaded from several mirrors. If the digest was computed
+            while downloading, the file is not read again. """
+        hash_ok = True
+        if element:
+            if not digest:
+                hash_type, _expected = dhash.get_expected_hash(element)
+                if hash_type:
+                    digest = dhash.get_file_hash(part_path, hash_type)
+            hash_ok = dhash.check_digest(element, hash_type, digest, part_path)
+
+        # Check hash of downloaded package
+        if not hash_ok:
+            # Wrong hash! Force to download the file again (from scratch)
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            self.progress.update(os.path.basename(dst_path), 0)
+            if url:
+                self.mirrors.record_failure(url)
             return False
 
+        os.replace(part_path, dst_path)
+        if hash_type and digest:
+            self.pacman_cache_index.remember(dst_path, hash_type, digest)
+        if url:
+            self.mirrors.record_success(url, downloaded, time.perf_counter() - start)
         return True
 
     @staticmethod
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# download_segmented.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Module to download big packages from several mirrors at the same time """
+
+import os
+import logging
+import socket
+import threading
+import time
+
+import requests
+
+
+class Segment():
+    """ Byte range [start, end) of a file """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        # Next byte to download
+        self.position = start
+
+    @property
+    def remaining(self):
+        """ Bytes left to download """
+        return self.end - self.position
+
+
+class SegmentedDownload():
+    """ Downloads one file splitting it in byte ranges that are fetched
+        from several (ranked) mirrors at once. Each range is written in
+        place (the file is preallocated), the way metalink clients do. """
+
+    # Only files bigger than this are split (bytes)
+    MIN_FILE_SIZE = 32 * 1024 * 1024
+
+    # Do not create segments smaller than this (bytes)
+    MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+
+    MAX_SEGMENTS = 4
+
+    # An idle segment thread helps a busy one if it still has
+    # more than this to download (bytes)
+    MIN_SPLIT_SIZE = 2 * 1024 * 1024
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, downloader, element, dst_path):
+        """ downloader is the download_requests.Download object that gives us
+            sessions, the mirrors scoreboard and the stop event """
+        self.downloader = downloader
+        self.element = element
+        self.dst_path = dst_path
+        self.part_path = dst_path + downloader.PART_SUFFIX
+        self.size = int(element['size'])
+        self.lock = threading.Lock()
+        self.segments = []
+        self.failed = False
+        self.part_fd = None
+
+    @staticmethod
+    def is_suitable(element):
+        """ Checks if the element is worth a segmented download """
+        try:
+            size = int(element.get('size'))
+        except (TypeError, ValueError):
+            return False
+        urls = [url for url in element['urls'] if url]
+        return size >= SegmentedDownload.MIN_FILE_SIZE and len(urls) > 1
+
+    def split(self, urls):
+        """ Creates the initial segments """
+        num_segments = min(
+            SegmentedDownload.MAX_SEGMENTS,
+            len(urls),
+            max(1, self.size // SegmentedDownload.MIN_SEGMENT_SIZE))
+        segment_size = self.size // num_segments
+        self.segments = []
+        for index in range(num_segments):
+            start = index * segment_size
+            if index == num_segments - 1:
+                end = self.size
+            else:
+                end = start + segment_size
+            self.segments.append(Segment(start, end))
+
+    def steal_segment(self):
+        """ Splits the segment with more data left in two. Returns the new
+            segment (the second half) or None if nothing is worth splitting """
+        with self.lock:
+            busiest = max(self.segments, key=lambda segment: segment.remaining)
+            if busiest.remaining < SegmentedDownload.MIN_SPLIT_SIZE:
+                return None
+            middle = busiest.position + busiest.remaining // 2
+            segment = Segment(middle, busiest.end)
+            busiest.end = middle
+            self.segments.append(segment)
+            return segment
+
+    def get_downloaded(self):
+        """ Bytes downloaded so far """
+        with self.lock:
+            return sum(segment.position - segment.start for segment in self.segments)
+
+    def start(self):
+        """ Downloads the file. Returns False if it can't be done """
+        urls = self.downloader.mirrors.sort_urls(self.element['urls'])
+        self.split(urls)
+
+        logging.debug(
+            "Downloading %s in %d segments from %d mirrors",
+            self.element['filename'], len(self.segments), len(urls))
+
+        self.part_fd = os.open(self.part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            try:
+                os.posix_fallocate(self.part_fd, 0, self.size)
+            except (AttributeError, OSError):
+                os.ftruncate(self.part_fd, self.size)
+
+            start = time.perf_counter()
+            threads = []
+            for index, segment in enumerate(list(self.segments)):
+                thread = threading.Thread(
+                    target=self.segment_worker, args=(segment, index, start))
+                thread.start()
+                threads.append(thread)
+
+            for thread in threads:
+                thread.join()
+        finally:
+            os.close(self.part_fd)
+            self.part_fd = None
+
+        if self.failed or self.downloader.stop_event.is_set():
+            self.remove_part()
+            self.downloader.progress.update(self.element['filename'], 0)
+            return False
+
+        # finish_part checks the hash and renames the file
+        return self.downloader.finish_part(
+            None, self.part_path, self.dst_path, self.element, self.size, start)
+
+    def remove_part(self):
+        """ A preallocated .part file can't be resumed, delete it """
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+    def segment_worker(self, segment, index, start):
+        """ Thread that downloads one segment and then helps with the others """
+        while segment is not None:
+            if not self.download_segment(segment, index, start):
+                self.failed = True
+                return
+            if self.failed:
+                return
+            segment = self.steal_segment()
+
+    def download_segment(self, segment, index, start):
+        """ Downloads a segment, trying all mirrors (starting with a different
+            one for each segment) """
+        mirrors = self.downloader.mirrors
+        urls = mirrors.sort_urls(self.element['urls'])
+        # Each segment starts with a different mirror
+        urls = urls[index % len(urls):] + urls[:index % len(urls)]
+        attempts = len(urls) + self.downloader.MAX_RESUMES
+
+        while attempts > 0 and segment.remaining > 0:
+            if self.failed or self.downloader.stop_event.is_set():
+                return False
+            attempts -= 1
+            url = urls[0]
+            urls = urls[1:] + urls[:1]
+
+            if self.downloader.stop_event.wait(mirrors.get_delay(url)):
+                return False
+
+            first_position = segment.position
+            segment_start = time.perf_counter()
+            try:
+                headers = {'Range': 'bytes={0}-{1}'.format(first_position, segment.end - 1)}
+                req = self.downloader.get_session().get(
+                    url, stream=True, timeout=30, headers=headers)
+                if (req.status_code != requests.codes.partial_content or
+                        self.downloader.get_range_start(
+                            req.headers.get('content-range')) != first_position):
+                    logging.debug(
+                        "%s does not support byte ranges (HTTP status %d)",
+                        url, req.status_code)
+                    req.close()
+                    if req.status_code == requests.codes.not_found:
+                        mirrors.record_missing(url)
+                    else:
+                        mirrors.record_failure(url)
+                    continue
+
+                for data in req.iter_content(SegmentedDownload.CHUNK_SIZE):
+                    if self.failed or self.downloader.stop_event.is_set():
+                        req.close()
+                        return False
+                    with self.lock:
+                        # Another thread may have taken part of our segment
+                        data = data[:segment.remaining]
+                        position = segment.position
+                    if not data:
+                        break
+                    os.pwrite(self.part_fd, data, position)
+                    with self.lock:
+                        segment.position += len(data)
+                    self.report_progress(start, len(data))
+                req.close()
+            except (socket.timeout,
+                    requests.exceptions.Timeout) as timeout_error:
+                logging.debug(timeout_error)
+                mirrors.record_failure(url, timeout=True)
+                continue
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError) as connection_error:
+                logging.debug(connection_error)
+                mirrors.record_failure(url)
+                continue
+
+            if segment.remaining > 0:
+                # Server closed the connection before sending all data
+                mirrors.record_failure(url)
+            else:
+                mirrors.record_success(
+                    url, segment.position - first_position,
+                    time.perf_counter() - segment_start)
+
+        return segment.remaining <= 0
+
+    def report_progress(self, start, transferred):
+        """ Shows download progress of the whole file """
+        downloaded = self.get_downloaded()
+        self.downloader.progress.update(
+            self.element['filename'], downloaded, transferred)
+        percent = round(downloaded / self.size, 2)
+        self.downloader.events.add('percent', percent)
+        bps = downloaded // max(time.perf_counter() - start, 0.001)
+        msg = self.downloader.format_progress_message(percent, bps)
+        self.downloader.events.add('progress_bar_show_text', msg)
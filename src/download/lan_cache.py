@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# lan_cache.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Shares package caches with other Cnchi installs in the same LAN """
+
+import logging
+import os
+import re
+import socket
+import subprocess
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# mDNS (avahi) service type
+SERVICE_TYPE = '_cnchi-cache._tcp'
+
+DEFAULT_PORT = 8079
+
+# Seconds to wait for avahi-browse answers
+DISCOVER_TIMEOUT = 3
+
+# Only packages (and their signatures) are served
+PACKAGE_RE = re.compile(r'^[^/]+\.pkg\.tar(\.[a-z0-9]+)?(\.sig)?$')
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    """ Sends packages (supports byte ranges, so downloads can be resumed) """
+
+    def log_message(self, msg_format, *args):
+        """ Log requests in Cnchi's log """
+        logging.debug("%s - %s", self.address_string(), msg_format % args)
+
+    def do_HEAD(self):
+        """ Sends package headers """
+        self.send_package(head=True)
+
+    def do_GET(self):
+        """ Sends package """
+        self.send_package(head=False)
+
+    def send_package(self, head):
+        """ Looks for the package in the cache dirs and sends it """
+        filename = os.path.basename(self.path.split('?')[0])
+        path = None
+        if PACKAGE_RE.match(filename):
+            path = self.server.find_package(filename)
+        if path is None:
+            self.send_error(404)
+            return
+
+        with open(path, 'rb') as package:
+            size = os.fstat(package.fileno()).st_size
+            start, end = 0, size - 1
+            match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */{0}'.format(size))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header(
+                    'Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, size))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            if head:
+                return
+            self.wfile.flush()
+
+            # Let the kernel copy the file to the socket
+            offset = start
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    sent = os.sendfile(
+                        self.connection.fileno(), package.fileno(), offset, remaining)
+                    if sent == 0:
+                        break
+                    offset += sent
+                    remaining -= sent
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+
+class CacheServer(ThreadingHTTPServer):
+    """ Serves the packages of several cache directories as a flat mirror
+        (http://host:port/<package filename>) """
+
+    daemon_threads = True
+
+    def __init__(self, cache_dirs, port=DEFAULT_PORT):
+        super().__init__(('', port), CacheRequestHandler)
+        self.cache_dirs = [
+            cache_dir for cache_dir in cache_dirs if os.path.isdir(cache_dir)]
+
+    def find_package(self, filename):
+        """ Returns the path of filename in the first cache dir that has it """
+        for cache_dir in self.cache_dirs:
+            path = os.path.join(cache_dir, filename)
+            if os.path.isfile(path):
+                return path
+        return None
+
+
+def publish(port):
+    """ Announces our cache server using avahi (mDNS). Returns the
+        avahi-publish process (or None if avahi is not available) """
+    name = "Cnchi package cache on {0}".format(socket.gethostname())
+    try:
+        return subprocess.Popen(
+            ['avahi-publish-service', name, SERVICE_TYPE, str(port)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+    except OSError as err:
+        logging.warning("Can't publish package cache using avahi: %s", err)
+        return None
+
+
+def serve(cache_dirs, port=DEFAULT_PORT):
+    """ Serves cache_dirs until interrupted """
+    server = CacheServer(cache_dirs, port)
+    avahi = publish(port)
+    logging.info(
+        "Serving packages from %s on port %d", ', '.join(server.cache_dirs), port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if avahi:
+            avahi.terminate()
+
+
+def discover(timeout=DISCOVER_TIMEOUT):
+    """ Looks for other Cnchi cache servers in the LAN using avahi (mDNS).
+        Returns their urls """
+    cmd = ['avahi-browse', '--resolve', '--terminate', '--parsable', SERVICE_TYPE]
+    try:
+        output = subprocess.check_output(
+            cmd, stderr=subprocess.DEVNULL, timeout=timeout).decode()
+    except (OSError, subprocess.SubprocessError) as err:
+        logging.debug("Can't look for LAN package caches: %s", err)
+        return []
+
+    local_addresses = get_local_addresses()
+    urls = []
+    for line in output.splitlines():
+        # =;interface;protocol;name;type;domain;hostname;address;port;txt
+        fields = line.split(';')
+        if len(fields) < 9 or fields[0] != '=' or fields[2] != 'IPv4':
+            continue
+        address, port = fields[7], fields[8]
+        if address in local_addresses:
+            continue
+        url = 'http://{0}:{1}/'.format(address, port)
+        if url not in urls:
+            logging.debug("Found LAN package cache at %s", url)
+            urls.append(url)
+    return urls
+
+
+def get_local_addresses():
+    """ Our own IPv4 addresses (we do not want to download from ourselves) """
+    try:
+        output = subprocess.check_output(
+            ['hostname', '--all-ip-addresses'], stderr=subprocess.DEVNULL).decode()
+        return set(output.split())
+    except (OSError, subprocess.SubprocessError):
+        return set()
+
+
+def get_mirrors(settings):
+    """ Returns the urls of the LAN package caches to use (given by the user
+        and, if asked to, found using mDNS). Discovery is only done once """
+    mirrors = []
+    for url in settings.get('lan_mirrors') or []:
+        if not url.endswith('/'):
+            url += '/'
+        if url not in mirrors:
+            mirrors.append(url)
+
+    if settings.get('lan_discover'):
+        for url in discover():
+            if url not in mirrors:
+                mirrors.append(url)
+        settings.set('lan_mirrors', mirrors)
+        settings.set('lan_discover', False)
+
+    if mirrors:
+        logging.debug("Using LAN package caches: %s", ', '.join(mirrors))
+    return mirrors
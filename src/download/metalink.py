@@ -30,43 +30,102 @@
 
 """ Operations with metalinks """
 
+import io
 import logging
-import tempfile
 import os
 
 import hashlib
 import re
 import argparse
 
-from collections import deque
+from collections import deque, OrderedDict
 
 from xml.dom.minidom import getDOMImplementation
 import xml.etree.cElementTree as elementTree
 
-import pyalpm
+try:
+    from pacman.provider_index import ProviderIndex
+except ModuleNotFoundError:
+    from provider_index import ProviderIndex
 
 MAX_URLS = 15
 
 
+class PlanEntry():
+    """ One package of a download plan. Attributes can also be read and
+        written like dict keys (entry['filename']), the way metalink info
+        elements have always been used """
+
+    __slots__ = ('identity', 'filename', 'size', 'version', 'description', 'hash', 'urls')
+
+    def __init__(self, identity=None, filename=None, size=None, version=None,
+                 description=None, hashes=None, urls=None):
+        self.identity = identity
+        self.filename = filename
+        self.size = size
+        self.version = version
+        self.description = description
+        # hash type ('sha256', 'md5') -> hex digest
+        self.hash = hashes or {}
+        self.urls = urls or []
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None
+
+    def get(self, key, default=None):
+        """ Same as dict.get """
+        value = getattr(self, key, None)
+        if value is None:
+            return default
+        return value
+
+    def __repr__(self):
+        return 'PlanEntry({0}, {1})'.format(self.identity, self.filename)
+
+    @classmethod
+    def from_pkg(cls, pkg, urls):
+        """ Creates an entry from a pyalpm package """
+        hashes = {}
+        for hash_type in ('sha256', 'md5'):
+            digest = getattr(pkg, hash_type + 'sum', None)
+            if digest:
+                hashes[hash_type] = digest
+        return cls(
+            identity=pkg.name,
+            filename=pkg.filename,
+            size=pkg.size,
+            version=pkg.version,
+            description=pkg.desc,
+            hashes=hashes,
+            urls=list(urls)[:MAX_URLS])
+
+
 def get_info(metalink):
     """ Reads metalink xml info and returns it """
 
     # tag = "{urn:ietf:params:xml:ns:metalink}"
 
-    temp_file = tempfile.NamedTemporaryFile(delete=False)
-    temp_file.write(str(metalink).encode('UTF-8'))
-    temp_file.close()
-
     metalink_info = {}
     element = {}
 
-    for event, elem in elementTree.iterparse(temp_file.name, events=('start', 'end')):
+    xml_file = io.BytesIO(str(metalink).encode('UTF-8'))
+    for event, elem in elementTree.iterparse(xml_file, events=('start', 'end')):
         if event == 'start':
             tag = elem.tag.split('}')[1]
             if tag == 'file':
                 element['filename'] = elem.attrib['name']
             elif tag == 'hash':
-                hash_type = elem.attrib['type']
+                # Metalink 4 names ('sha-256') are stored as 'sha256'
+                hash_type = elem.attrib['type'].replace('-', '')
                 try:
                     element['hash'][hash_type] = elem.text
                 except KeyError:
@@ -87,21 +146,22 @@ def get_info(metalink):
             element.clear()
             elem.clear()
 
-    if os.path.exists(temp_file.name):
-        os.remove(temp_file.name)
-
     return metalink_info
 
 
-def create(alpm, package_name, pacman_conf_file):
-    """ Creates a metalink to download package_name and its dependencies """
+def get_download_queue(alpm, package_names, pacman_conf_file):
+    """ Resolves package_names and their dependencies. Returns the
+        download queue or None if a package can't be found """
+
+    if isinstance(package_names, str):
+        package_names = [package_names]
 
     options = ["--conf", pacman_conf_file, "--noconfirm", "--all-deps"]
 
-    if package_name == "databases":
+    if package_names == ["databases"]:
         options.append("--refresh")
     else:
-        options.append(package_name)
+        options.extend(package_names)
 
     download_queue, not_found, missing_deps = build_download_queue(
         alpm, args=options)
@@ -113,17 +173,68 @@ def create(alpm, package_name, pacman_conf_file):
         return None
 
     if missing_deps:
-        missing_deps = sorted(missing_deps)
+        missing_deps = sorted(set(missing_deps))
         msg = "Can't resolve these dependencies: " + ' '.join(missing_deps)
         logging.error(msg)
         return None
 
-    if download_queue:
-        metalink = download_queue_to_metalink(download_queue)
-        return metalink
+    if not download_queue:
+        logging.error(
+            "Unable to create download queue for packages %s", ' '.join(package_names))
+        return None
+
+    return download_queue
 
-    logging.error("Unable to create download queue for package %s", package_name)
-    return None
+
+def create_plan(alpm, package_names, pacman_conf_file):
+    """ Creates a download plan (identity -> PlanEntry) for package_names
+        and their dependencies. Built straight from the pyalpm packages,
+        use plan_to_metalink if a metalink is needed """
+    download_queue = get_download_queue(alpm, package_names, pacman_conf_file)
+    if download_queue is None:
+        return None
+    return download_queue_to_plan(download_queue)
+
+
+def create_transaction_plan(alpm, package_names, conflicts=None):
+    """ Creates a download plan with exactly the packages a prepared (download
+        only) alpm transaction needs (see Pac.get_transaction_packages). Use
+        it with the handle that will install the packages, so dependencies are
+        resolved against the target system the same way pacman will do """
+    packages = alpm.get_transaction_packages(package_names, conflicts)
+    if packages is None:
+        return None
+    plan = OrderedDict()
+    for pkg in packages:
+        plan[pkg.name] = PlanEntry.from_pkg(pkg, get_pkg_urls(pkg))
+    return plan
+
+
+def download_queue_to_plan(download_queue):
+    """ Converts a download_queue object to a download plan """
+    plan = OrderedDict()
+    for pkg, urls, _sigs in download_queue.sync_pkgs:
+        if pkg.name not in plan:
+            plan[pkg.name] = PlanEntry.from_pkg(pkg, urls)
+    return plan
+
+
+def plan_to_metalink(plan):
+    """ Serializes a download plan as a metalink """
+    metalink = Metalink()
+    for entry in plan.values():
+        metalink.add_element(entry)
+    return metalink
+
+
+def create(alpm, package_names, pacman_conf_file):
+    """ Creates a metalink to download package_names and their dependencies.
+        All packages are resolved at once, so shared dependencies are only
+        looked up one time. package_names can also be a single package name """
+    download_queue = get_download_queue(alpm, package_names, pacman_conf_file)
+    if download_queue is None:
+        return None
+    return download_queue_to_metalink(download_queue)
 
 # From here comes modified code from pm2ml
 # pm2ml is Copyright (C) 2012-2013 Xyne
@@ -194,6 +305,27 @@ class Metalink():
         if sigs:
             self.add_file(pkg.filename + '.sig', (u + '.sig' for u in urls))
 
+    def add_element(self, element):
+        """ Add a package from a download plan entry (or a get_info element).
+            Hashes use metalink 4 (RFC 5854) names, so downloaders can
+            check them """
+        file_ = self.doc.createElement("file")
+        file_.setAttribute("name", element['filename'])
+        self.files.appendChild(file_)
+        for tag_name in ('identity', 'size', 'version', 'description'):
+            if element.get(tag_name) is not None:
+                tag = self.doc.createElement(tag_name)
+                file_.appendChild(tag)
+                tag.appendChild(self.doc.createTextNode(str(element[tag_name])))
+        hashes = element.get('hash') or {}
+        for hash_type, hash_name in (('sha256', 'sha-256'), ('md5', 'md5')):
+            if hashes.get(hash_type):
+                tag = self.doc.createElement('hash')
+                tag.setAttribute('type', hash_name)
+                file_.appendChild(tag)
+                tag.appendChild(self.doc.createTextNode(hashes[hash_type]))
+        self.add_urls(file_, [url for url in element['urls'] if url])
+
     def add_file(self, name, urls):
         """Add a signature file."""
         file_ = self.doc.createElement("file")
@@ -338,25 +470,26 @@ def get_antergos_repo_pkgs(alpm_handle):
     return repo_pkgs, antdb
 
 
-def resolve_deps(alpm_handle, other, alldeps):
+def resolve_deps(alpm_handle, other, alldeps, provider_index=None):
     """ Resolve dependencies """
     missing_deps = []
     queue = deque(other)
-    local_cache = alpm_handle.get_localdb().pkgcache
-    syncdbs = alpm_handle.get_syncdbs()
+    if provider_index is None:
+        provider_index = ProviderIndex(alpm_handle.get_syncdbs())
+    local_index = None
+    if not alldeps:
+        local_index = ProviderIndex([alpm_handle.get_localdb()])
     seen = set(queue)
     while queue:
         pkg = queue.popleft()
         for dep in pkg.depends:
-            if pyalpm.find_satisfier(local_cache, dep) is None or alldeps:
-                for database in syncdbs:
-                    prov = pyalpm.find_satisfier(database.pkgcache, dep)
-                    if prov:
-                        other.add(prov)
-                        if prov.name not in seen:
-                            seen.add(prov.name)
-                            queue.append(prov)
-                        break
+            if alldeps or local_index.find_satisfier(dep) is None:
+                prov = provider_index.find_satisfier(dep)
+                if prov:
+                    other.add(prov)
+                    if prov.name not in seen:
+                        seen.add(prov.name)
+                        queue.append(prov)
                 else:
                     missing_deps.append(dep)
     return other, missing_deps
@@ -415,7 +548,8 @@ def build_download_queue(alpm, args=None):
 
     # Resolve dependencies.
     if other and not pargs.nodeps:
-        other, missing_deps = resolve_deps(handle, other, pargs.alldeps)
+        other, missing_deps = resolve_deps(
+            handle, other, pargs.alldeps, alpm.get_provider_index())
 
     found |= set(other.pkgs)
     not_found = requested - found
@@ -443,19 +577,17 @@ def build_download_queue(alpm, args=None):
             siglevel = None
         download_sig = needs_sig(siglevel, pargs.sigs, 'Package')
 
-        urls = []
-        server_urls = list(pkg.db.servers)
-        for server_url in server_urls:
-            url = os.path.join(server_url, pkg.filename)
-            urls.append(url)
+        download_queue.add_sync_pkg(pkg, get_pkg_urls(pkg), download_sig)
 
-        # Limit to MAX_URLS url
-        while len(urls) > MAX_URLS:
-            urls.pop()
+    return download_queue, not_found, missing_deps
 
-        download_queue.add_sync_pkg(pkg, urls, download_sig)
 
-    return download_queue, not_found, missing_deps
+def get_pkg_urls(pkg):
+    """ Returns the urls of a sync package (limited to MAX_URLS) """
+    urls = [
+        os.path.join(server_url, pkg.filename)
+        for server_url in pkg.db.servers]
+    return urls[:MAX_URLS]
 
 
 def get_checksum(path, typ):
@@ -539,8 +671,8 @@ def test_module():
     print("Creating metalink...")
     meta4 = create(
         alpm=pacman,
-        #package_name="ipw2200-fw",
-        package_name="base-devel",
+        #package_names=["ipw2200-fw"],
+        package_names=["base-devel"],
         pacman_conf_file="/etc/pacman.conf")
     #print(meta4)
     #print('=' * 20)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mirror_health.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Keeps track of mirror health while downloading packages """
+
+import logging
+import threading
+import time
+import urllib.parse
+
+
+class HostStats():
+    """ Stores what we know about one mirror host """
+
+    def __init__(self):
+        # Consecutive failures (reset when a download works)
+        self.failures = 0
+        self.total_failures = 0
+        self.timeouts = 0
+        self.downloaded_bytes = 0
+        self.download_time = 0.0
+        # Do not use this host before this time (time.monotonic())
+        self.retry_at = 0.0
+        self.quarantined = False
+
+    @property
+    def throughput(self):
+        """ Observed bytes per second (None if we don't know yet) """
+        if self.download_time <= 0:
+            return None
+        return self.downloaded_bytes / self.download_time
+
+
+class MirrorHealth():
+    """ Shared per-host scoreboard. Download workers record here failures,
+        timeouts and throughput of each mirror, so bad mirrors are demoted
+        (or not used at all) for the rest of the installation """
+
+    # Exponential backoff after a failure (seconds)
+    BASE_DELAY = 2
+    MAX_DELAY = 60
+
+    # Consecutive failures before a host is not used anymore
+    QUARANTINE_FAILURES = 3
+
+    # Hosts slower than this fraction of the fastest one are demoted
+    SLOW_FRACTION = 0.25
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+        # LAN package caches (they do not have every package)
+        self.cache_hosts = set()
+
+    @staticmethod
+    def get_host(url):
+        """ Returns the host part of an url """
+        return urllib.parse.urlsplit(url).netloc
+
+    def get_stats(self, url):
+        """ Returns stats of url's host (must be called with lock held) """
+        host = self.get_host(url)
+        if host not in self.hosts:
+            self.hosts[host] = HostStats()
+        return self.hosts[host]
+
+    def add_cache_host(self, url):
+        """ A missing package in url's host is not a mirror failure """
+        with self.lock:
+            self.cache_hosts.add(self.get_host(url))
+
+    def record_success(self, url, downloaded_bytes, download_time):
+        """ Stores a successful download """
+        with self.lock:
+            stats = self.get_stats(url)
+            stats.failures = 0
+            stats.retry_at = 0.0
+            stats.downloaded_bytes += downloaded_bytes
+            stats.download_time += download_time
+
+    def record_failure(self, url, timeout=False):
+        """ Stores a failed download and delays the next use of this host """
+        with self.lock:
+            stats = self.get_stats(url)
+            stats.failures += 1
+            stats.total_failures += 1
+            if timeout:
+                stats.timeouts += 1
+            delay = min(
+                MirrorHealth.BASE_DELAY * 2 ** (stats.failures - 1),
+                MirrorHealth.MAX_DELAY)
+            stats.retry_at = time.monotonic() + delay
+            if stats.failures >= MirrorHealth.QUARANTINE_FAILURES and not stats.quarantined:
+                stats.quarantined = True
+                logging.warning(
+                    "Mirror %s failed %d times in a row. It won't be used anymore.",
+                    self.get_host(url), stats.failures)
+
+    def record_missing(self, url):
+        """ Stores that url's host does not have the file (HTTP 404). LAN
+            caches only have the packages their machine has downloaded,
+            so they are not punished for it """
+        with self.lock:
+            if self.get_host(url) in self.cache_hosts:
+                return
+        self.record_failure(url)
+
+    def is_quarantined(self, url):
+        """ Checks if url's host should not be used anymore """
+        with self.lock:
+            return self.get_stats(url).quarantined
+
+    def get_delay(self, url):
+        """ Returns how many seconds we should wait before using url """
+        with self.lock:
+            return max(0.0, self.get_stats(url).retry_at - time.monotonic())
+
+    def sort_urls(self, urls):
+        """ Returns urls sorted by host health. Quarantined hosts are removed
+            (unless there is nothing else left). Hosts waiting after a failure
+            and slow hosts go after the good ones. Otherwise the original
+            (rankmirrors) order is kept """
+        urls = [url for url in urls if url]
+        now = time.monotonic()
+
+        with self.lock:
+            speeds = [
+                stats.throughput for stats in self.hosts.values()
+                if stats.throughput]
+            fastest = max(speeds) if speeds else 0
+
+            def sort_key(index_url):
+                """ Sort helper """
+                index, url = index_url
+                stats = self.get_stats(url)
+                waiting = stats.retry_at > now
+                throughput = stats.throughput
+                slow = bool(throughput and throughput < fastest * MirrorHealth.SLOW_FRACTION)
+                return (stats.quarantined, waiting, slow, index)
+
+            sorted_urls = [url for _index, url in sorted(enumerate(urls), key=sort_key)]
+            usable = [url for url in sorted_urls if not self.get_stats(url).quarantined]
+
+        return usable or sorted_urls
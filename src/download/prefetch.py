@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# prefetch.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Downloads packages in the background while the user is still
+    answering the installer questions """
+
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+import pyalpm
+
+from download import download
+from download import staging
+
+from installation import select_packages as pack
+
+from misc.extra import InstallError
+
+
+class Prefetch(multiprocessing.Process):
+    """ Once the desktop and its features are chosen, most of the packages
+        that will be installed are already known. This process downloads them
+        (with low priority) to the staging directory, where the installation
+        will find them (see staging.py). Packages that are not needed in the
+        end are discarded then. """
+
+    # There can only be one prefetch process at a time
+    current = None
+
+    # Prefetch processes that have not ended yet (the current one and
+    # the ones being stopped)
+    running = set()
+    running_lock = threading.Lock()
+
+    NICENESS = 19
+
+    # Do not take all the bandwidth (the user may be browsing the web)
+    MAX_WORKERS = 2
+
+    # Seconds stop() waits for the process to end before terminating it
+    # (it is called from the GUI, and refreshing databases or resolving
+    # packages can take a while)
+    STOP_TIMEOUT = 3
+
+    def __init__(self, settings):
+        super().__init__(daemon=True)
+        self.settings = settings
+        self.stop_event = multiprocessing.Event()
+
+    def run(self):
+        """ Selects, resolves and downloads packages """
+        try:
+            os.nice(Prefetch.NICENESS)
+        except OSError as err:
+            logging.debug("Can't lower prefetch priority: %s", err)
+
+        # Let stop() end us cleanly (alpm transactions get released)
+        signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+
+        try:
+            if self.stop_event.is_set():
+                return
+            pkg = pack.SelectPackages(self.settings, None)
+            pkg.refresh_pacman_databases()
+            if self.stop_event.is_set():
+                return
+            try:
+                packages = pkg.select_stable_packages()
+            finally:
+                pkg.release_pacman()
+            if self.stop_event.is_set():
+                return
+
+            # Resolve package dependencies
+            pacman_conf = {}
+            pacman_conf['file'] = self.settings.get('pacman_config_file')
+            pacman_conf['cache'] = staging.get_staging_dir(self.settings)
+            down = download.DownloadPackages(
+                package_names=packages,
+                pacman_conf=pacman_conf,
+                settings=self.settings)
+            down.create_metalinks_list()
+            if not down.metalinks or self.stop_event.is_set():
+                return
+
+            staging_download = staging.StagingDownload(
+                down.metalinks, self.settings, max_workers=Prefetch.MAX_WORKERS)
+        except (InstallError, pyalpm.error, OSError) as err:
+            # Not important, packages will be downloaded later
+            logging.warning("Can't prefetch packages: %s", err)
+            return
+
+        if self.stop_event.is_set():
+            return
+
+        logging.debug("Prefetching %d packages", len(down.metalinks))
+        watcher = threading.Thread(
+            target=self.watch_stop, args=(staging_download,), daemon=True)
+        watcher.start()
+        staging_download.run()
+
+    def watch_stop(self, staging_download):
+        """ Stops the download when the installation is about to begin """
+        self.stop_event.wait()
+        staging_download.stop()
+
+    def stop(self):
+        """ Asks the prefetch process to end """
+        self.stop_event.set()
+
+
+def start(settings):
+    """ Starts prefetching packages (if the user asked for it) """
+    if not settings.get('download_prefetch') or settings.get('feature_lembrame'):
+        return
+    if settings.get('bundle'):
+        # Packages are already here
+        return
+    stop()
+    prefetch = Prefetch(settings)
+    with Prefetch.running_lock:
+        Prefetch.running.add(prefetch)
+        settings.set('prefetch_running', True)
+    prefetch.start()
+    Prefetch.current = prefetch
+
+
+def stop():
+    """ Stops prefetching packages (waits for it a few seconds at most).
+        The process is never killed: it may be inside alpm holding the
+        database lock. Use wait() before using alpm again. """
+    prefetch = Prefetch.current
+    Prefetch.current = None
+    if prefetch is None:
+        return
+
+    prefetch.stop()
+    prefetch.join(Prefetch.STOP_TIMEOUT)
+    if prefetch.is_alive():
+        # Still refreshing databases or resolving packages. SIGTERM ends
+        # it (releasing alpm) once it is back from alpm's C code.
+        # Partially downloaded packages are resumed later.
+        logging.debug("Prefetch process did not stop in time, terminating it")
+        prefetch.terminate()
+    reaper = threading.Thread(target=reap, args=(prefetch,), daemon=True)
+    reaper.start()
+
+
+def reap(prefetch):
+    """ Waits for a stopped prefetch process to end """
+    prefetch.join()
+    with Prefetch.running_lock:
+        Prefetch.running.discard(prefetch)
+        if not Prefetch.running:
+            prefetch.settings.set('prefetch_running', False)
+
+
+def wait(settings):
+    """ Waits until no prefetch process is running (so the alpm database
+        lock is free). Can be called from any process """
+    if settings.get('prefetch_running'):
+        logging.debug("Waiting for the prefetch process to end")
+        settings.wait_for('prefetch_running', lambda running: not running)
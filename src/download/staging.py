@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# staging.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Downloads packages to a staging cache while the disks are prepared """
+
+import logging
+import os
+import shutil
+import threading
+
+try:
+    import download.download_requests as download_requests
+    import download.lan_cache as lan_cache
+    from download.cache_index import CacheIndex
+    from download.download_progress import get_element_size
+except ModuleNotFoundError:
+    import download_requests
+    import lan_cache
+    from cache_index import CacheIndex
+    from download_progress import get_element_size
+
+from misc.events import Events
+
+# When testing, no _() is available
+try:
+    _("")
+except NameError as err:
+    def _(message):
+        return message
+
+
+class StagingEvents(Events):
+    """ Only the downloads progress bar is shown while staging, the main
+        progress bar and info messages belong to the formatting process """
+
+    def add(self, event_type, event_text=""):
+        """ Drops all events not related to the downloads progress bar """
+        if event_type.startswith('downloads_'):
+            super().add(event_type, event_text)
+
+
+class StagingDownload(threading.Thread):
+    """ Downloads packages to a staging directory (in the live system) as
+        soon as the metalinks are known, so the network is not idle while
+        the disks are formatted and pacman is prepared. Once the target is
+        mounted, the staged packages are moved to its pacman cache. """
+
+    # There can only be one staging download at a time
+    current = None
+
+    STAGING_DIR_NAME = 'pkg-staging'
+
+    # Free space left in the staging filesystem (bytes)
+    MIN_FREE_SPACE = 1024 * 1024 * 1024
+
+    def __init__(self, metalinks, settings, callback_queue=None, max_workers=None):
+        super().__init__(daemon=True)
+        self.staging_dir = get_staging_dir(settings)
+        os.makedirs(self.staging_dir, mode=0o755, exist_ok=True)
+
+        # Packages may have been prefetched before (see prefetch.py)
+        self.discard_unneeded(metalinks)
+        # Packages found in the user's caches do not need to be staged
+        metalinks = self.discard_cached(metalinks, settings.get('xz_cache'))
+        self.metalinks = self.select_packages(metalinks)
+        self.result = False
+
+        self.download = download_requests.Download(
+            self.staging_dir,
+            [],
+            None,
+            settings.get('proxies'),
+            max_workers or settings.get('download_workers'))
+        self.download.events = StagingEvents(callback_queue)
+        self.download.store_hashes = True
+        for lan_mirror in lan_cache.get_mirrors(settings):
+            self.download.mirrors.add_cache_host(lan_mirror)
+
+    def discard_unneeded(self, metalinks):
+        """ Deletes staged packages that are not going to be installed """
+        filenames = set(element['filename'] for element in metalinks.values())
+        part_suffix = download_requests.Download.PART_SUFFIX
+        try:
+            with os.scandir(self.staging_dir) as entries:
+                for entry in entries:
+                    filename = entry.name
+                    if filename.endswith(part_suffix):
+                        filename = filename[:-len(part_suffix)]
+                    if entry.name.startswith('.') or filename in filenames:
+                        continue
+                    logging.debug("Discarding %s (not needed anymore)", entry.name)
+                    os.remove(entry.path)
+        except OSError as err:
+            logging.warning("Can't clean %s: %s", self.staging_dir, err)
+
+    @staticmethod
+    def discard_cached(metalinks, xz_cache_dirs):
+        """ Returns the packages that are not in any of the xz cache dirs
+            (they will be copied from there when the target is mounted) """
+        cached = {}
+        for xz_cache_dir in xz_cache_dirs or []:
+            if os.path.isdir(xz_cache_dir):
+                index = CacheIndex(xz_cache_dir, persistent=False)
+                for filename, path in index.files.items():
+                    cached.setdefault(filename, path)
+
+        selected = {}
+        for key, element in metalinks.items():
+            path = cached.get(element['filename'])
+            if path:
+                size = get_element_size(element)
+                try:
+                    if not size or os.path.getsize(path) == size:
+                        continue
+                except OSError:
+                    pass
+            selected[key] = element
+
+        if len(selected) < len(metalinks):
+            logging.debug(
+                "%d packages are already in the xz cache, they won't be staged",
+                len(metalinks) - len(selected))
+        return selected
+
+    def select_packages(self, metalinks):
+        """ Returns the packages that fit in the staging filesystem """
+        try:
+            budget = shutil.disk_usage(self.staging_dir).free - StagingDownload.MIN_FREE_SPACE
+        except OSError as err:
+            logging.warning("Can't check free space in %s: %s", self.staging_dir, err)
+            return {}
+
+        selected = {}
+        for key, element in metalinks.items():
+            size = get_element_size(element)
+            if os.path.exists(os.path.join(self.staging_dir, element['filename'])):
+                # Already staged, it does not need more space
+                size = 0
+            if size <= budget:
+                selected[key] = element
+                budget -= size
+
+        if len(selected) < len(metalinks):
+            logging.debug(
+                "Only %d of %d packages fit in %s",
+                len(selected), len(metalinks), self.staging_dir)
+        return selected
+
+    def run(self):
+        """ Downloads selected packages """
+        if not self.metalinks:
+            return
+        logging.debug(
+            "Downloading %d packages to %s while the disks are being prepared",
+            len(self.metalinks), self.staging_dir)
+        try:
+            self.result = self.download.start(self.metalinks)
+        except OSError as err:
+            logging.warning("Error downloading packages to %s: %s", self.staging_dir, err)
+            self.result = False
+        if not self.result:
+            # Not fatal, the missing packages will be downloaded later
+            logging.warning("Could not download all packages to %s", self.staging_dir)
+
+    def stop(self):
+        """ Stops downloading (already staged packages are kept) """
+        self.download.stop_event.set()
+
+
+def get_staging_dir(settings):
+    """ Returns where packages are staged """
+    return os.path.join(settings.get('temp'), StagingDownload.STAGING_DIR_NAME)
+
+
+def start(metalinks, settings, callback_queue=None):
+    """ Starts downloading packages to the staging directory """
+    if settings.get('bundle'):
+        # Packages are already here
+        return
+    if StagingDownload.current is not None:
+        StagingDownload.current.stop()
+        StagingDownload.current.join()
+    try:
+        staging = StagingDownload(metalinks, settings, callback_queue)
+    except OSError as err:
+        logging.warning("Can't download packages in advance: %s", err)
+        return
+    staging.start()
+    StagingDownload.current = staging
+
+
+def finish(settings, events=None):
+    """ Waits for the staging download to end. Returns the staging directory
+        (to be used as a package source) or None if there isn't one """
+    staging = StagingDownload.current
+    StagingDownload.current = None
+    if staging is not None and staging.is_alive():
+        if events:
+            events.add('info', _("Waiting for the packages being downloaded..."))
+        staging.join()
+
+    # There may be prefetched packages even if there was no staging download
+    staging_dir = get_staging_dir(settings)
+    if os.path.isdir(staging_dir):
+        return staging_dir
+    return None
+
+
+def remove(staging_dir):
+    """ Deletes the staging directory (and all packages left in it) """
+    if staging_dir:
+        shutil.rmtree(staging_dir, ignore_errors=True)
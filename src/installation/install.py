@@ -32,7 +32,9 @@ import sys
 
 from mako.template import Template
 
+from download import bundle
 from download import download
+from download import staging
 
 from installation import special_dirs
 from installation import post_install
@@ -95,6 +97,10 @@ class Installation():
 
         self.pacman_cache_dir = ''
 
+        # Package downloader (keeps copying packages to the xz caches
+        # while pacman installs them)
+        self.downloader = None
+
         # Cnchi will store here info (packages needed, post install actions, ...)
         # for the detected hardware
         self.hardware_install = None
@@ -301,6 +307,9 @@ class Installation():
         logging.debug("Installing packages...")
         self.install_packages()
 
+        logging.debug("Waiting for packages to be copied to the cache dirs...")
+        self.downloader.wait_cache_writes()
+
         logging.debug("Configuring system...")
         post = post_install.PostInstallation(
             self.settings,
@@ -344,16 +353,39 @@ class Installation():
         pacman_conf['file'] = Installation.TMP_PACMAN_CONF
         pacman_conf['cache'] = self.pacman_cache_dir
 
-        download_packages = download.DownloadPackages(
+        # Packages may have been downloaded while formatting (see process.py)
+        staging_dir = staging.finish(self.settings, self.events)
+
+        self.downloader = download.DownloadPackages(
             package_names=self.packages,
             pacman_conf=pacman_conf,
             settings=self.settings,
-            callback_queue=self.events.queue)
-
-        # Metalinks have already been calculated before,
-        # When downloadpackages class has been called in process.py to test
-        # that Cnchi was able to create it before partitioning/formatting
-        download_packages.start_download(self.metalinks)
+            callback_queue=self.events.queue,
+            staging_dir=staging_dir)
+
+        # Metalinks were calculated in process.py (before partitioning) using
+        # the live system. Now that the target is ready, ask alpm which files
+        # it will really need, so it won't have to download anything itself.
+        if self.downloader.create_transaction_metalinks(self.pacman):
+            self.log_plan_changes(self.downloader.metalinks)
+            self.downloader.start_download()
+        else:
+            logging.warning(
+                "Can't get the packages to download from alpm, using the previous list")
+            self.downloader.start_download(self.metalinks)
+
+        staging.remove(staging_dir)
+
+    def log_plan_changes(self, metalinks):
+        """ Logs differences between the live system and target downloads lists """
+        if not self.metalinks:
+            return
+        added = sorted(set(metalinks) - set(self.metalinks))
+        removed = sorted(set(self.metalinks) - set(metalinks))
+        if added:
+            logging.debug("alpm also needs these packages: %s", ', '.join(added))
+        if removed:
+            logging.debug("alpm does not need these packages: %s", ', '.join(removed))
 
     def create_pacman_conf_file(self):
         """ Creates a temporary pacman.conf """
@@ -366,10 +398,18 @@ class Installation():
         template_file_name = os.path.join(
             self.settings.get('data'), 'pacman.tmpl')
         file_template = Template(filename=template_file_name)
+        bundle_repo = None
+        bundle_repos = []
+        if self.settings.get('bundle'):
+            # Only the repositories the bundle has databases for
+            bundle_repo = bundle.get_repo_dir(self.settings.get('bundle'))
+            bundle_repos = bundle.load_manifest(self.settings.get('bundle'))['repos']
         file_rendered = file_template.render(
             destDir=DEST_DIR,
             arch=myarch,
-            desktop=self.desktop)
+            desktop=self.desktop,
+            bundle=bundle_repo,
+            bundle_repos=bundle_repos)
         filename = Installation.TMP_PACMAN_CONF
         dirname = os.path.dirname(filename)
         os.makedirs(dirname, mode=0o755, exist_ok=True)
@@ -387,7 +427,7 @@ class Installation():
 
         # Init pyalpm
         try:
-            self.pacman = pac.Pac(
+            self.pacman = pac.Pac.get_session(
                 Installation.TMP_PACMAN_CONF, self.events.queue)
         except Exception as ex:
             self.pacman = None
@@ -397,6 +437,11 @@ class Installation():
             logging.error(message)
             raise InstallError(message)
 
+        # Databases have just been refreshed in the live system (see
+        # select_packages). Copy them, so only the ones that have changed
+        # since then (or use other mirrors) are downloaded again.
+        self.pacman.seed_databases(self.settings.get('pacman_config_file'))
+
         # Refresh pacman databases
         if not self.pacman.refresh():
             logging.error("Can't refresh pacman databases.")
@@ -471,10 +516,10 @@ class Installation():
     def install_packages(self):
         """ Start pacman installation of packages """
         result = False
-        # This shouldn't be necessary if download.py really downloaded all
-        # needed packages, but it does not do it (why?)
-        for cache_dir in self.settings.get('xz_cache'):
-            self.pacman.handle.add_cachedir(cache_dir)
+
+        # All packages must have been downloaded to the target cache by now.
+        # Otherwise alpm would download them itself, one by one.
+        self.check_pending_downloads()
 
         logging.debug("Installing packages...")
 
@@ -490,7 +535,7 @@ class Installation():
             logging.warning(
                 "Can't install necessary packages. Let's try again deleting stale packages first.")
             self.delete_stale_pkgs(stale_pkgs)
-            self.pacman.refresh()
+            self.pacman.refresh(force=True)
             try:
                 result = self.pacman.install(pkgs=self.packages)
             except pac.pyalpm.error:
@@ -501,12 +546,14 @@ class Installation():
             logging.warning(
                 "Can't install necessary packages. Let's try again using a tier 1 mirror.")
             self.use_build_server_repo()
-            self.pacman.refresh()
+            self.pacman.refresh(force=True)
             try:
                 result = self.pacman.install(pkgs=self.packages)
             except pac.pyalpm.error:
                 pass
 
+        self.pacman.write_timeline_report()
+
         if not result:
             txt = _("Can't install necessary packages. Cnchi can't continue.")
             raise InstallError(txt)
@@ -514,6 +561,24 @@ class Installation():
         # All downloading and installing has been done, so we hide progress bar
         self.events.add('progress_bar', 'hide')
 
+    def check_pending_downloads(self):
+        """ Fails if alpm would still need to download any package """
+        try:
+            pending = self.pacman.get_pending_downloads(self.packages)
+        except pac.pyalpm.error:
+            pending = None
+
+        if pending is None:
+            logging.warning("Can't check if all packages have been downloaded")
+        elif pending:
+            filenames = sorted(pkg.filename for pkg in pending)
+            logging.error(
+                "alpm would still download %d packages: %s",
+                len(filenames), ', '.join(filenames))
+            txt = _("These packages have not been downloaded: {0}").format(
+                ', '.join(filenames))
+            raise InstallError(txt)
+
     def is_running(self):
         """ Checks if thread is running """
         return self.running
@@ -42,6 +42,8 @@ from misc.events import Events
 import misc.extra as misc
 
 from download import download
+from download import prefetch
+from download import staging
 
 from installation import select_packages as pack
 
@@ -139,6 +141,9 @@ class Process(multiprocessing.Process):
             # overwrite the one used by the installer by default
             self.prepare_lembrame()
 
+            # A prefetch process that is still ending may hold the alpm lock
+            prefetch.wait(self.settings)
+
             # Before formatting, let's try to calculate package download list
             # this way, if something fails (a missing package, mostly) we have
             # not formatted anything yet.
@@ -149,6 +154,11 @@ class Process(multiprocessing.Process):
             # package list
             self.overwrite_variables_lembrame()
 
+            # Start downloading packages now, so the network is not idle
+            # while the disks are formatted and pacman is prepared
+            if self.settings.get('download_ahead'):
+                staging.start(self.down.metalinks, self.settings, self.events.queue)
+
             self.events.add(
                 'info', _("Getting your disk(s) ready for Antergos..."))
             with misc.raised_privileges():
@@ -26,7 +26,6 @@
 
 import logging
 import os
-import subprocess
 import requests
 from requests.exceptions import RequestException
 
@@ -74,6 +73,9 @@ class SelectPackages():
 
         self.xml_root = None
 
+        # alpm (pac.Pac) opened by refresh_pacman_databases
+        self.pacman = None
+
         # If Lembrame enabled set pacman.conf pointing to the decrypted folder
         if self.settings.get('feature_lembrame'):
             self.lembrame = Lembrame(self.settings)
@@ -91,7 +93,10 @@ class SelectPackages():
         logging.debug("Pacman ready")
 
         logging.debug("Selecting packages...")
-        self.select_packages()
+        try:
+            self.select_packages()
+        finally:
+            self.release_pacman()
         logging.debug("Packages selected")
 
         # Fix bug #263 (v86d moved from [extra] to AUR)
@@ -107,7 +112,8 @@ class SelectPackages():
         """ Updates pacman databases """
         # Init pyalpm
         try:
-            pacman = pac.Pac(self.settings.get('pacman_config_file'), self.events.queue)
+            pacman = pac.Pac.get_session(
+                self.settings.get('pacman_config_file'), self.events.queue)
         except Exception as ex:
             template = (
                 "Can't initialize pyalpm. An exception of type {0} occured. Arguments:\n{1!r}")
@@ -117,19 +123,18 @@ class SelectPackages():
 
         # Refresh pacman databases
         if not pacman.refresh():
+            pacman.release()
             logging.error("Can't refresh pacman databases.")
             txt = _("Can't refresh pacman databases.")
             raise InstallError(txt)
 
-        try:
-            pacman.release()
-            del pacman
-        except Exception as ex:
-            template = (
-                "Can't release pyalpm. An exception of type {0} occured. Arguments:\n{1!r}")
-            message = template.format(type(ex).__name__, ex.args)
-            logging.error(message)
-            raise InstallError(message)
+        # It's used to check that selected packages exist
+        self.pacman = pacman
+
+    def release_pacman(self):
+        """ Stops using the alpm session opened by refresh_pacman_databases.
+            It's not closed, the next phase (download) will use it too """
+        self.pacman = None
 
     def add_package(self, pkg):
         """ Adds xml node text to our package list
@@ -366,32 +371,36 @@ class SelectPackages():
         # This is done mainly to avoid errors when Arch removes a package silently
         self.check_packages()
 
+    def select_stable_packages(self):
+        """ Returns the packages that won't change once the desktop and its
+            features have been chosen (the ones that depend on later choices,
+            like the bootloader, are left out). Used to prefetch them. """
+        self.packages = []
+        self.load_xml_root_node()
+        self.add_edition_packages()
+        self.add_drivers()
+        self.add_filesystems()
+        self.maybe_add_chinese_fonts()
+        self.add_features()
+        self.cleanup_packages_list()
+        return self.packages
+
     def check_packages(self):
-        """ Checks that all selected packages ARE in the repositories """
-        not_found = []
-        self.events.add('percent', 0)
+        """ Checks that all selected packages ARE in the repositories
+            (as packages, groups or provided by another package) """
         self.events.add('info', _("Checking that all selected packages are available online..."))
-        num_pkgs = len(self.packages)
-        for index, pkg_name in enumerate(self.packages):
-            # TODO: Use libalpm instead
-            cmd = ["/usr/bin/pacman", "-Ss", pkg_name]
-            try:
-                output = subprocess.check_output(cmd).decode()
-            except subprocess.CalledProcessError:
-                output = ""
-
-            if pkg_name not in output:
-                not_found.append(pkg_name)
-                logging.error("Package %s...NOT FOUND!", pkg_name)
-
-            percent = (index + 1) / num_pkgs
-            self.events.add('percent', percent)
+
+        if self.pacman is None:
+            self.refresh_pacman_databases()
+
+        not_found = self.pacman.find_missing(self.packages)
+        for pkg_name in not_found:
+            logging.error("Package %s...NOT FOUND!", pkg_name)
 
         if not_found:
             txt = _("Cannot find these packages: {}").format(', '.join(not_found))
             raise misc.InstallError(txt)
 
-
     def cleanup_packages_list(self):
         """ Cleans up a bit our packages list """
         # Remove duplicates
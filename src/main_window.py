@@ -38,6 +38,8 @@ import desktop_info
 import info
 import misc.extra as misc
 
+from download import bundle
+
 import pages.welcome
 import pages.language
 import pages.location
@@ -127,6 +129,10 @@ class MainWindow(Gtk.ApplicationWindow):
         # Store cache dirs in config
         self.settings.set('xz_cache', xz_cache)
 
+        # Install from a package bundle (see download/bundle.py)
+        if cmd_line.bundle:
+            bundle.setup(cmd_line.bundle, self.settings)
+
         data_dir = self.settings.get('data')
 
         # For things we are not ready for users to test
@@ -135,6 +141,17 @@ class MainWindow(Gtk.ApplicationWindow):
         # a11y
         self.settings.set('a11y', cmd_line.a11y)
 
+        # Download packages while the user is answering our questions
+        self.settings.set('download_prefetch', cmd_line.prefetch)
+
+        if cmd_line.aria2:
+            self.settings.set('download_backend', 'aria2')
+
+        # Package caches shared by other computers in the LAN
+        if cmd_line.lan_mirror:
+            self.settings.set('lan_mirrors', cmd_line.lan_mirror)
+        self.settings.set('lan_discover', cmd_line.lan_discover)
+
         # Set enabled desktops
         if self.settings.get('hidden'):
             self.settings.set('desktops', desktop_info.DESKTOPS_DEV)
@@ -35,6 +35,7 @@ from socket import timeout
 import string
 import subprocess
 import syslog
+import time
 import urllib
 import ssl
 import dbus
@@ -476,6 +477,18 @@ def has_connection():
     return False
 
 
+def wait_for_connection(settings=None, retry=4, max_wait=60):
+    """ Waits until there is an Internet connection available.
+        While the check page (CheckProcess) says there is no connection,
+        we sleep until it tells otherwise (or max_wait seconds pass)
+        instead of trying again every retry seconds """
+    while not has_connection():
+        if settings is not None and not settings.get('has_internet'):
+            settings.wait_for('has_internet', timeout=max_wait)
+        else:
+            time.sleep(retry)
+
+
 def inside_hypervisor():
     """ Checks if running inside an hypervisor (VM) """
 
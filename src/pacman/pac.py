@@ -42,6 +42,9 @@ from misc.events import Events
 import pacman.alpm_include as _alpm
 import pacman.pkginfo as pkginfo
 import pacman.pacman_conf as config
+import pacman.sync_db as sync_db
+import pacman.timeline as timeline
+from pacman.provider_index import ProviderIndex, RequiredByIndex
 
 try:
     import pyalpm
@@ -65,6 +68,10 @@ class Pac():
     """ Communicates with libalpm using pyalpm """
     LOG_FOLDER = '/var/log/cnchi'
 
+    # Shared alpm sessions (see get_session)
+    # (process id, pacman.conf path, root dir) -> Pac
+    sessions = {}
+
     def __init__(self, conf_path="/etc/pacman.conf", callback_queue=None):
         self.events = Events(callback_queue)
 
@@ -72,6 +79,14 @@ class Pac():
 
         self.handle = None
 
+        # Key in Pac.sessions (if this is a shared session)
+        self.session_key = None
+
+        # Name and provisions index of sync dbs (see get_provider_index)
+        self.provider_index = None
+        # Reverse dependencies index of sync dbs (see get_requiredby_index)
+        self.requiredby_index = None
+
         self.logger = None
         self.setup_logger()
 
@@ -90,17 +105,55 @@ class Pac():
 
         self.last_event = {}
 
+        # Time spent in each transaction phase, package and hook
+        self.timeline = timeline.Timeline()
+
         if not os.path.exists(conf_path):
             raise pyalpm.error
 
         if conf_path is not None and os.path.exists(conf_path):
-            self.config = config.PacmanConfig(conf_path)
+            self.config = config.load(conf_path)
+            self.config_state = config.get_files_state(self.config.files)
             self.initialize_alpm()
             logging.debug('ALPM repository database order is: %s',
                           self.config.repo_order)
         else:
             raise pyalpm.error
 
+    @classmethod
+    def get_session(cls, conf_path="/etc/pacman.conf", callback_queue=None):
+        """ Returns the Pac object already created in this process for the
+            same pacman.conf and root dir (or creates it). This way sync
+            databases and their package caches stay loaded between the
+            installation phases. Call release() to really close it """
+        if not os.path.exists(conf_path):
+            raise pyalpm.error
+        root_dir = config.load(conf_path).options["RootDir"]
+        key = (os.getpid(), os.path.realpath(conf_path), root_dir)
+        pacman = cls.sessions.get(key)
+        if pacman is not None and pacman.is_config_changed():
+            # pacman.conf (or a mirrorlist) has been modified
+            pacman.release()
+            pacman = None
+        if pacman is None or pacman.handle is None:
+            pacman = cls(conf_path, callback_queue)
+            pacman.session_key = key
+            cls.sessions[key] = pacman
+        else:
+            logging.debug("Reusing alpm session for %s (root dir %s)", conf_path, root_dir)
+            pacman.events = Events(callback_queue)
+        return pacman
+
+    def is_config_changed(self):
+        """ Checks if the files config was read from have been modified """
+        return config.get_files_state(self.config.files) != self.config_state
+
+    def invalidate(self):
+        """ Discards data computed from the sync databases (call it after
+            they change, refresh() already does) """
+        self.provider_index = None
+        self.requiredby_index = None
+
     @staticmethod
     def format_size(size):
         """ Formats downloaded size into a string """
@@ -115,6 +168,13 @@ class Pac():
         """ Return alpm handle """
         return self.handle
 
+    def get_provider_index(self):
+        """ Returns an index of all packages (and what they provide) in the
+            sync databases. It is built only once (until dbs are refreshed) """
+        if self.provider_index is None:
+            self.provider_index = ProviderIndex(self.handle.get_syncdbs())
+        return self.provider_index
+
     def get_config(self):
         """ Get pacman.conf config """
         return self.config
@@ -157,6 +217,9 @@ class Pac():
 
     def release(self):
         """ Release alpm handle """
+        self.invalidate()
+        if Pac.sessions.get(self.session_key) is self:
+            del Pac.sessions[self.session_key]
         if self.handle is not None:
             del self.handle
             self.handle = None
@@ -232,47 +295,63 @@ class Pac():
 
         return self.finalize_transaction(transaction)
 
-    def refresh(self):
-        """ Sync databases like pacman -Sy """
+    def refresh(self, force=False):
+        """ Sync databases like pacman -Sy (or -Syy if force is True).
+            All databases are downloaded at the same time, and only if
+            they have changed. alpm updates the ones we could not get """
         if self.handle is None:
             logging.error("alpm is not initialised")
             raise pyalpm.error
 
-        force = True
+        self.invalidate()
+        failed = sync_db.fetch(self.config, force)
+
+        # alpm must load the new databases
+        self.initialize_alpm()
+
         res = True
         for database in self.handle.get_syncdbs():
+            if database.name not in failed:
+                continue
             transaction = self.init_transaction()
             if transaction:
-                database.update(force)
-                transaction.release()
+                try:
+                    database.update(force)
+                finally:
+                    transaction.release()
             else:
                 res = False
         return res
 
-    def install(self, pkgs, conflicts=None, options=None):
-        """ Install a list of packages like pacman -S """
+    def seed_databases(self, src_conf_path="/etc/pacman.conf"):
+        """ Copies the sync databases of another pacman installation (by
+            default, the live system) that uses the same mirrors, so
+            refresh() does not need to download them again """
+        if not os.path.exists(src_conf_path):
+            return []
+        src_config = config.load(src_conf_path)
+        if src_config.options["DBPath"] == self.config.options["DBPath"]:
+            return []
+        copied = sync_db.seed(src_config, self.config)
+        if copied:
+            self.invalidate()
+            self.initialize_alpm()
+        return copied
+
+    def get_targets(self, pkgs, conflicts=None):
+        """ Returns the sync packages to install for pkgs (names of packages
+            or groups). Packages in conflicts are left out, and packages of
+            some groups are only taken from the antergos repository """
 
         if not conflicts:
             conflicts = []
 
-        if not options:
-            options = {}
-
-        if self.handle is None:
-            logging.error("alpm is not initialised")
-            raise pyalpm.error
-
-        if not pkgs:
-            logging.error("Package list is empty")
-            raise pyalpm.error
-
         # Discard duplicates
         pkgs = list(set(pkgs))
 
         # `alpm.handle.get_syncdbs()` returns a list (the order is important) so we
         # have to ensure we don't clobber the priority of the repos.
         repos = OrderedDict()
-        repo_order = []
         db_match = [db for db in self.handle.get_syncdbs()
                     if db.name == 'antergos']
         antdb = OrderedDict()
@@ -291,10 +370,10 @@ class Pac():
                          for pkg in one_repo_group[1] if one_repo_group}
 
         for syncdb in self.handle.get_syncdbs():
-            repo_order.append(syncdb)
             repos[syncdb.name] = syncdb
 
-        targets = []
+        # package name -> sync package
+        targets = OrderedDict()
         for name in pkgs:
             _repos = repos
 
@@ -307,7 +386,7 @@ class Pac():
             if result_ok:
                 # Check that added package is not in our conflicts list
                 if pkg.name not in conflicts:
-                    targets.append(pkg.name)
+                    targets[pkg.name] = pkg
             else:
                 # Couldn't find the package, check if it's a group
                 group_pkgs = self.get_group_pkgs(name)
@@ -318,7 +397,7 @@ class Pac():
                         # Ex: connman conflicts with netctl(openresolv),
                         # which is installed by default with base group
                         if group_pkg.name not in conflicts:
-                            targets.append(group_pkg.name)
+                            targets.setdefault(group_pkg.name, group_pkg)
                 else:
                     # No, it wasn't neither a package nor a group. As we don't
                     # know if this error is fatal or not, we'll register it and
@@ -326,9 +405,27 @@ class Pac():
                     logging.error(
                         "Can't find a package or group called '%s'", name)
 
-        # Discard duplicates
-        targets = list(set(targets))
-        logging.debug(targets)
+        return list(targets.values())
+
+    def install(self, pkgs, conflicts=None, options=None):
+        """ Install a list of packages like pacman -S """
+
+        if not options:
+            options = {}
+
+        if self.handle is None:
+            logging.error("alpm is not initialised")
+            raise pyalpm.error
+
+        if not pkgs:
+            logging.error("Package list is empty")
+            raise pyalpm.error
+
+        # Only time this installation
+        self.timeline = timeline.Timeline()
+
+        targets = self.get_targets(pkgs, conflicts)
+        logging.debug([pkg.name for pkg in targets])
 
         if not targets:
             logging.error("No targets found")
@@ -347,15 +444,56 @@ class Pac():
             logging.error("Can't initialize alpm transaction")
             return False
 
-        for _index in range(0, num_targets):
-            result_ok, pkg = self.find_sync_package(targets.pop(), repos)
-            if result_ok:
-                transaction.add_pkg(pkg)
-            else:
-                logging.warning(pkg)
+        for pkg in targets:
+            transaction.add_pkg(pkg)
 
         return self.finalize_transaction(transaction)
 
+    def get_transaction_packages(self, pkgs, conflicts=None, options=None):
+        """ Prepares (but does not commit) a download only transaction with
+            the same targets install() would use. Returns all packages alpm
+            would install (targets and dependencies) or None on error """
+
+        if self.handle is None:
+            logging.error("alpm is not initialised")
+            raise pyalpm.error
+
+        targets = self.get_targets(pkgs, conflicts)
+        if not targets:
+            logging.error("No targets found")
+            return None
+
+        options = dict(options) if options else {}
+        options['downloadonly'] = True
+        transaction = self.init_transaction(options)
+
+        if transaction is None:
+            logging.error("Can't initialize alpm transaction")
+            return None
+
+        packages = None
+        try:
+            for pkg in targets:
+                transaction.add_pkg(pkg)
+            transaction.prepare()
+            packages = list(transaction.to_add)
+        except pyalpm.error as err:
+            logging.error("Can't prepare alpm transaction: %s", err)
+        transaction.release()
+        return packages
+
+    def get_pending_downloads(self, pkgs, conflicts=None, options=None):
+        """ Returns the packages alpm would still have to download (because
+            they are not in its cache dirs) to install pkgs. None on error """
+        packages = self.get_transaction_packages(pkgs, conflicts, options)
+        if packages is None:
+            return None
+        cache_dirs = self.handle.cachedirs
+        return [
+            pkg for pkg in packages
+            if not any(os.path.exists(os.path.join(cache_dir, pkg.filename))
+                       for cache_dir in cache_dirs)]
+
     def upgrade(self, pkgs, conflicts=None, options=None):
         """ Install a list package tarballs like pacman -U """
 
@@ -412,45 +550,73 @@ class Pac():
                 return pkgs
         return None
 
-    def get_packages_info(self, pkg_names=None):
-        """ Get information about packages like pacman -Si """
-        if not pkg_names:
-            pkg_names = []
-        packages_info = {}
+    def lookup(self, names):
+        """ Looks up names (packages, groups or provisions, like 'sh') in the
+            sync databases in one go. Returns an OrderedDict name -> sync
+            package (for packages and provisions), list of packages (for
+            groups) or None (if not found) """
+        index = self.get_provider_index()
+        groups = {}
+        for database in self.handle.get_syncdbs():
+            for group_name, group_pkgs in database.grpcache:
+                groups.setdefault(group_name, group_pkgs)
+
+        found = OrderedDict()
+        for name in names:
+            pkg = index.find_satisfier(name)
+            if pkg is None:
+                pkg = groups.get(name)
+            found[name] = pkg
+        return found
+
+    def find_missing(self, names):
+        """ Returns the names that are neither a package, nor a group nor
+            provided by any package in the sync databases """
+        return [name for name, pkg in self.lookup(names).items() if not pkg]
+
+    def get_requiredby_index(self):
+        """ Returns an index of what the packages in the sync databases
+            depend on. It is built only once (until dbs are refreshed) """
+        if self.requiredby_index is None:
+            self.requiredby_index = RequiredByIndex(self.handle.get_syncdbs())
+        return self.requiredby_index
+
+    def get_package_views(self, pkg_names=None):
+        """ Returns lazy package info views (pkginfo.PackageView) of
+            pkg_names (or of all packages in all repos if None), like
+            pacman -Si. Package info is only read when it is used """
+        views = OrderedDict()
         if not pkg_names:
-            # Store info from all packages from all repos
+            # All packages from all repos
+            index = self.get_requiredby_index()
             for repo in self.handle.get_syncdbs():
                 for pkg in repo.pkgcache:
-                    packages_info[pkg.name] = pkginfo.get_pkginfo(
-                        pkg,
-                        level=2,
-                        style='sync')
-        else:
-            repos = OrderedDict((database.name, database)
-                                for database in self.handle.get_syncdbs())
-            for pkg_name in pkg_names:
-                result_ok, pkg = self.find_sync_package(pkg_name, repos)
-                if result_ok:
-                    packages_info[pkg_name] = pkginfo.get_pkginfo(
-                        pkg,
-                        level=2,
-                        style='sync')
-                else:
-                    packages_info = {}
-                    logging.error(pkg)
-        return packages_info
+                    if pkg.name not in views:
+                        views[pkg.name] = pkginfo.PackageView(
+                            pkg, level=2, style='sync', requiredby_index=index)
+            return views
 
-    def get_package_info(self, pkg_name):
+        provider_index = self.get_provider_index()
+        for pkg_name in pkg_names:
+            pkg = provider_index.get_package(pkg_name)
+            if pkg is None:
+                logging.error("Package %s not found in any sync database", pkg_name)
+                return OrderedDict()
+            views[pkg_name] = pkginfo.PackageView(
+                pkg, level=2, style='sync', requiredby_index=self.get_requiredby_index())
+        return views
+
+    def get_packages_info(self, pkg_names=None, fields=None):
+        """ Get information about packages like pacman -Si. Only fields
+            (names as in pkginfo.FIELDS) are read if given. All packages
+            from all repos are used if pkg_names is empty """
+        return {
+            pkg_name: view.to_dict(fields)
+            for pkg_name, view in self.get_package_views(pkg_names).items()}
+
+    def get_package_info(self, pkg_name, fields=None):
         """ Get information about packages like pacman -Si """
-        repos = OrderedDict((database.name, database)
-                            for database in self.handle.get_syncdbs())
-        result_ok, pkg = self.find_sync_package(pkg_name, repos)
-        if result_ok:
-            info = pkginfo.get_pkginfo(pkg, level=2, style='sync')
-        else:
-            logging.error(pkg)
-            info = {}
-        return info
+        return self.get_packages_info([pkg_name], fields).get(pkg_name, {})
 
     # Callback functions
 
@@ -461,6 +627,8 @@ class Pac():
 
     def cb_event(self, event, event_data):
         """ Converts action ID to descriptive text and enqueues it to the events queue """
+        self.timeline.event(event)
+
         action = self.last_action
 
         if event == _alpm.ALPM_EVENT_CHECKDEPS_START:
@@ -511,6 +679,7 @@ class Pac():
 
         # Log everything to cnchi-alpm.log
         self.logger.debug(line)
+        self.timeline.log(line)
 
         logmask = pyalpm.LOG_ERROR | pyalpm.LOG_WARNING
 
@@ -527,6 +696,8 @@ class Pac():
 
     def cb_progress(self, target, percent, total, current):
         """ Shows install progress """
+        self.timeline.progress(target, percent)
+
         if target:
             action = _("Installing {0} ({1}/{2})").format(target, current, total)
             percent = current / total
@@ -571,6 +742,11 @@ class Pac():
             self.already_transferred += total
             self.downloaded_packages += 1
 
+    def write_timeline_report(self, top=timeline.DEFAULT_TOP):
+        """ Writes where the time of the last installation went (next to
+            cnchi-alpm.log), listing the top slowest packages and hooks """
+        return self.timeline.write_report(Pac.LOG_FOLDER, top)
+
     def is_package_installed(self, package_name):
         """ Check if package is already installed """
         database = self.handle.get_localdb()
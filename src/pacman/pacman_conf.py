@@ -88,11 +88,14 @@ BOOLEAN_OPTIONS = (
 )
 
 
-def pacman_conf_enumerator(path):
-    """ Parse pacman.conf file """
+def pacman_conf_enumerator(path, read_files=None):
+    """ Parse pacman.conf file. Paths of all files read (included ones
+        too) are appended to read_files (if given) """
     filestack = []
     current_section = None
     filestack.append(open(path))
+    if read_files is not None:
+        read_files.append(path)
     while filestack:
         file_obj = filestack[-1]
         line = file_obj.readline()
@@ -120,7 +123,10 @@ def pacman_conf_enumerator(path):
 
         # include files
         if equal == '=' and key == 'Include':
-            filestack.extend(open(f) for f in glob.glob(value))
+            included = glob.glob(value)
+            filestack.extend(open(f) for f in included)
+            if read_files is not None:
+                read_files.extend(included)
             continue
         if current_section != 'options':
             # repos only have the Server, SigLevel, Usage options
@@ -163,6 +169,8 @@ class PacmanConfig(collections.OrderedDict):
         self.options["LogFile"] = "/var/log/cnchi/pacman.log"
         self.options["Architecture"] = os.uname()[-1]
         self.repo_order = []
+        # Files parsed (pacman.conf and the ones it includes)
+        self.files = []
         if conf is not None:
             self.load_from_file(conf)
         if options is not None:
@@ -170,7 +178,7 @@ class PacmanConfig(collections.OrderedDict):
 
     def load_from_file(self, filename):
         """ Load pacman options from file (pacman.conf) """
-        for section, key, value in pacman_conf_enumerator(filename):
+        for section, key, value in pacman_conf_enumerator(filename, self.files):
             if section == 'options':
                 if key == 'Architecture' and value == 'auto':
                     continue
@@ -185,6 +193,27 @@ class PacmanConfig(collections.OrderedDict):
         if "CacheDir" not in self.options:
             self.options["CacheDir"] = ["/var/cache/pacman/pkg"]
 
+    def snapshot(self):
+        """ Returns a copy of the parsed options and repos (to restore them
+            later or in another object without parsing the file again) """
+        options = collections.OrderedDict(
+            (key, list(value) if isinstance(value, list) else value)
+            for key, value in self.options.items())
+        repos = collections.OrderedDict(
+            (repo, list(servers)) for repo, servers in self.repos.items())
+        return options, repos
+
+    def restore(self, snapshot):
+        """ Restores options and repos from a snapshot """
+        options, repos = snapshot
+        self['options'] = collections.OrderedDict(
+            (key, list(value) if isinstance(value, list) else value)
+            for key, value in options.items())
+        self.options = self['options']
+        self.repos = collections.OrderedDict(
+            (repo, list(servers)) for repo, servers in repos.items())
+        self.repo_order = []
+
     def load_from_options(self, options):
         """ Load options from 'options' variable """
         #global _LOGMASK
@@ -223,7 +252,8 @@ class PacmanConfig(collections.OrderedDict):
 
         # h.logcb = cb_log
 
-        # set sync databases
+        # set sync databases (apply can be called again with a new handle)
+        self.repo_order = []
         for repo, servers in self.repos.items():
             self.repo_order.append(repo)
             database = handle.register_syncdb(repo, 0)
@@ -249,3 +279,34 @@ class PacmanConfig(collections.OrderedDict):
                     conf = '{0}{1} = {2}\n'.format(conf, key, value)
             conf += '\n'
         return conf
+
+
+# Parsed files, path -> (state of the files read, snapshot)
+_PARSED = {}
+
+
+def get_files_state(paths):
+    """ Modification time and size of paths (to know if they have changed) """
+    state = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            state.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            state.append((path, None, None))
+    return state
+
+
+def load(path):
+    """ Returns a PacmanConfig for path. Files are only parsed again if
+        they (or the ones they include) change, otherwise a snapshot of
+        the previous parse is restored """
+    cached = _PARSED.get(path)
+    if cached and get_files_state(f for f, _mtime, _size in cached[0]) == cached[0]:
+        conf = PacmanConfig()
+        conf.restore(cached[1])
+        conf.files = [f for f, _mtime, _size in cached[0]]
+        return conf
+    conf = PacmanConfig(path)
+    _PARSED[path] = (get_files_state(conf.files), conf.snapshot())
+    return conf
@@ -32,6 +32,9 @@ import sys
 import time
 import textwrap
 
+from collections import OrderedDict
+from collections.abc import Mapping
+
 import struct
 import fcntl
 import termios
@@ -163,74 +166,115 @@ def display_pkginfo(pkg, level=1, style='local'):
     print('')
 
 
-def get_pkginfo(pkg, level=1, style='local'):
-    """ Stores package info into a dictonary """
-    if style not in ['local', 'sync', 'file']:
+def get_reason(pkg):
+    """ Install reason of a local package """
+    if pkg.reason == pyalpm.PKG_REASON_EXPLICIT:
+        return _('Explicitly installed')
+    if pkg.reason == pyalpm.PKG_REASON_DEPEND:
+        return _('Installed as a dependency for another package')
+    return 'N/A'
+
+
+def get_backup(pkg):
+    """ Backup files of a local package """
+    if not pkg.backup:
+        return None
+    return [(md5, filename) for (filename, md5) in pkg.backup]
+
+
+ALL_STYLES = ('local', 'sync', 'file')
+
+# Package info fields (in get_pkginfo order):
+#   name -> (function that gets the value, styles, minimum level)
+# 'required by' is special: it is shown at level 1 in the local style
+FIELDS = OrderedDict([
+    ('repository', (lambda view: view.pkg.db.name, ('sync',), 1)),
+    ('name', (lambda view: view.pkg.name, ALL_STYLES, 1)),
+    ('version', (lambda view: view.pkg.version, ALL_STYLES, 1)),
+    ('url', (lambda view: view.pkg.url, ALL_STYLES, 1)),
+    ('licenses', (lambda view: view.pkg.licenses, ALL_STYLES, 1)),
+    ('groups', (lambda view: view.pkg.groups, ALL_STYLES, 1)),
+    ('provides', (lambda view: view.pkg.provides, ALL_STYLES, 1)),
+    ('depends on', (lambda view: view.pkg.depends, ALL_STYLES, 1)),
+    ('optional deps', (lambda view: view.pkg.optdepends, ALL_STYLES, 1)),
+    ('required by', (lambda view: view.get_requiredby(), ALL_STYLES, 2)),
+    ('conflicts with', (lambda view: view.pkg.conflicts, ALL_STYLES, 1)),
+    ('replaces', (lambda view: view.pkg.replaces, ALL_STYLES, 1)),
+    ('download size', (lambda view: view.pkg.size / 1024, ('sync',), 1)),
+    ('compressed size', (lambda view: view.pkg.size / 1024, ('file',), 1)),
+    ('installed size', (lambda view: view.pkg.isize / 1024, ALL_STYLES, 1)),
+    ('packager', (lambda view: view.pkg.packager, ALL_STYLES, 1)),
+    ('architecture', (lambda view: view.pkg.arch, ALL_STYLES, 1)),
+    ('build date', (lambda view: view.pkg.builddate, ALL_STYLES, 1)),
+    ('install date', (lambda view: view.pkg.installdate, ('local',), 1)),
+    ('install reason', (lambda view: get_reason(view.pkg), ('local',), 1)),
+    ('install script', (
+        lambda view: 'Yes' if view.pkg.has_scriptlet else 'No', ('local', 'file'), 1)),
+    ('md5 sum', (lambda view: view.pkg.md5sum, ('sync',), 1)),
+    ('sha256 sum', (lambda view: view.pkg.sha256sum, ('sync',), 1)),
+    ('signatures', (lambda view: 'Yes' if view.pkg.base64_sig else 'No', ('sync',), 1)),
+    ('description', (lambda view: view.pkg.desc, ALL_STYLES, 1)),
+    ('backup files', (lambda view: get_backup(view.pkg), ('local',), 2)),
+])
+
+
+def get_fields(level=1, style='local'):
+    """ Returns the names of the fields shown for a level and style """
+    if style not in ALL_STYLES:
         raise ValueError('Invalid style for package info formatting')
+    fields = []
+    for name, (_getter, styles, min_level) in FIELDS.items():
+        if name == 'required by' and style == 'local':
+            min_level = 1
+        if style in styles and level >= min_level:
+            fields.append(name)
+    return fields
+
+
+class PackageView(Mapping):
+    """ Read only dictionary with the info of a package (like the one
+        get_pkginfo returns), but values are only read from the pyalpm
+        package when asked for (and then kept).
+
+        requiredby_index is a provider_index.RequiredByIndex shared by
+        many views. Without it, pkg.compute_requiredby() is used """
+
+    __slots__ = ('pkg', 'fields', 'requiredby_index', 'values')
+
+    def __init__(self, pkg, level=1, style='local', requiredby_index=None):
+        self.pkg = pkg
+        self.fields = get_fields(level, style)
+        self.requiredby_index = requiredby_index
+        self.values = {}
+
+    def __getitem__(self, key):
+        if key not in self.values:
+            if key not in self.fields:
+                raise KeyError(key)
+            getter = FIELDS[key][0]
+            self.values[key] = getter(self)
+        return self.values[key]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def get_requiredby(self):
+        """ Names of the packages that depend on this one """
+        if self.requiredby_index is not None:
+            return self.requiredby_index.get_requiredby(self.pkg)
+        return self.pkg.compute_requiredby()
+
+    def to_dict(self, fields=None):
+        """ Returns a dict with fields (all of them if None). Fields not
+            shown for this level and style are left out """
+        if fields is None:
+            fields = self.fields
+        return {key: self[key] for key in fields if key in self.fields}
 
-    info = {}
-
-    if style == 'sync':
-        info['repository'] = pkg.db.name
-
-    info['name'] = pkg.name
-    info['version'] = pkg.version
-    info['url'] = pkg.url
-    info['licenses'] = pkg.licenses
-    info['groups'] = pkg.groups
-    info['provides'] = pkg.provides
-    info['depends on'] = pkg.depends
-    info['optional deps'] = pkg.optdepends
-
-    if style == 'local' or level == 2:
-        info['required by'] = pkg.compute_requiredby()
-
-    info['conflicts with'] = pkg.conflicts
-    info['replaces'] = pkg.replaces
-
-    if style == 'sync':
-        info['download size'] = pkg.size / 1024
-
-    if style == 'file':
-        info['compressed size'] = pkg.size / 1024
 
-    info['installed size'] = pkg.isize / 1024
-    info['packager'] = pkg.packager
-    info['architecture'] = pkg.arch
-    info['build date'] = pkg.builddate
-
-    if style == 'local':
-        # local installation information
-        info['install date'] = pkg.installdate
-        if pkg.reason == pyalpm.PKG_REASON_EXPLICIT:
-            reason = _('Explicitly installed')
-        elif pkg.reason == pyalpm.PKG_REASON_DEPEND:
-            reason = _('Installed as a dependency for another package')
-        else:
-            reason = 'N/A'
-        info['install reason'] = reason
-
-    if style != 'sync':
-        if pkg.has_scriptlet:
-            info['install script'] = 'Yes'
-        else:
-            info['install script'] = 'No'
-
-    if style == 'sync':
-        info['md5 sum'] = pkg.md5sum
-        info['sha256 sum'] = pkg.sha256sum
-        if pkg.base64_sig:
-            info['signatures'] = 'Yes'
-        else:
-            info['signatures'] = 'No'
-
-    info['description'] = pkg.desc
-
-    if level >= 2 and style == 'local':
-        if not pkg.backup:
-            info['backup files'] = None
-        else:
-            info['backup files'] = [(md5, filename)
-                                    for (filename, md5) in pkg.backup]
-
-    return info
+def get_pkginfo(pkg, level=1, style='local'):
+    """ Stores package info into a dictonary """
+    return PackageView(pkg, level, style).to_dict()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  provider_index.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Index of package names and provisions, to satisfy dependencies
+    without scanning whole package caches """
+
+import re
+
+try:
+    import pyalpm
+except ImportError as err:
+    # This is already logged elsewhere
+    # logging.error(err)
+    pass
+
+# name, comparison operator (optional) and version (optional)
+DEPENDENCY_RE = re.compile(r'^([^<>=]+)(<=|>=|<|>|=)?(.*)$')
+
+
+def parse_dependency(dependency):
+    """ Splits a dependency string like 'glibc>=2.26' in its name,
+        operator and version (operator and version can be None) """
+    match = DEPENDENCY_RE.match(dependency)
+    if not match:
+        return dependency, None, None
+    name, operator, version = match.groups()
+    if not operator:
+        return name, None, None
+    return name, operator, version
+
+
+def version_satisfies(version, operator, wanted_version):
+    """ Checks if version satisfies the 'operator wanted_version' constraint """
+    if operator is None:
+        return True
+    if version is None:
+        return False
+    result = pyalpm.vercmp(version, wanted_version)
+    if operator == '=':
+        return result == 0
+    if operator == '>=':
+        return result >= 0
+    if operator == '<=':
+        return result <= 0
+    if operator == '>':
+        return result > 0
+    return result < 0
+
+
+class ProviderIndex():
+    """ Maps package names and provisions to the packages that have them.
+        Candidates are kept in the same order libalpm would try them: by
+        database (repo order), real packages before provisions, and by
+        position in the database. """
+
+    def __init__(self, databases):
+        # name -> [(database position, package, version), ...]
+        self.packages = {}
+        self.provisions = {}
+        # dependency string -> (name, operator, version)
+        self.dependencies = {}
+        # dependency string -> satisfier (or None)
+        self.satisfiers = {}
+
+        for position, database in enumerate(databases):
+            for pkg in database.pkgcache:
+                self.packages.setdefault(pkg.name, []).append(
+                    (position, pkg, pkg.version))
+                for provision in pkg.provides:
+                    name, operator, version = self.parse(provision)
+                    if operator != '=':
+                        # Only 'name' or 'name=version' provisions are valid
+                        version = None
+                    self.provisions.setdefault(name, []).append(
+                        (position, pkg, version))
+
+    def parse(self, dependency):
+        """ Same as parse_dependency, but each string is only parsed once """
+        parsed = self.dependencies.get(dependency)
+        if parsed is None:
+            parsed = parse_dependency(dependency)
+            self.dependencies[dependency] = parsed
+        return parsed
+
+    def get_package(self, name):
+        """ Returns the first package called name (in repo order) """
+        candidates = self.packages.get(name)
+        if candidates:
+            return candidates[0][1]
+        return None
+
+    def find_satisfier(self, dependency):
+        """ Returns the package that satisfies dependency (like pacman, repo
+            order comes first) or None if there isn't any """
+        if dependency in self.satisfiers:
+            return self.satisfiers[dependency]
+
+        name, operator, version = self.parse(dependency)
+        best = None
+        best_key = None
+        for is_provision, candidates in enumerate(
+                (self.packages.get(name, []), self.provisions.get(name, []))):
+            for position, pkg, pkg_version in candidates:
+                if version_satisfies(pkg_version, operator, version):
+                    key = (position, is_provision)
+                    if best_key is None or key < best_key:
+                        best, best_key = pkg, key
+                    break
+
+        self.satisfiers[dependency] = best
+        return best
+
+
+class RequiredByIndex():
+    """ Maps package names and provisions to the packages that depend on
+        them, so the packages that require a package can be found without
+        scanning all databases each time (as pkg.compute_requiredby does) """
+
+    def __init__(self, databases):
+        # name -> [(package name, operator, version), ...]
+        self.dependents = {}
+        for database in databases:
+            for pkg in database.pkgcache:
+                for dependency in pkg.depends:
+                    name, operator, version = parse_dependency(dependency)
+                    self.dependents.setdefault(name, []).append(
+                        (pkg.name, operator, version))
+
+    def get_requiredby(self, pkg):
+        """ Returns the names of the packages that depend on pkg (on its
+            name or on one of its provisions), sorted """
+        provisions = [(pkg.name, pkg.version)]
+        for provision in pkg.provides:
+            name, operator, version = parse_dependency(provision)
+            provisions.append((name, version if operator == '=' else None))
+
+        requiredby = set()
+        for name, version in provisions:
+            for dependent, operator, wanted_version in self.dependents.get(name, []):
+                if version_satisfies(version, operator, wanted_version):
+                    requiredby.add(dependent)
+        return sorted(requiredby)
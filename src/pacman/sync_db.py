@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  sync_db.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Downloads sync databases in parallel (only when they have changed)
+    and copies them between pacman installations """
+
+import email.utils
+import logging
+import os
+import shutil
+import threading
+
+import requests
+
+# Seconds to wait for a mirror
+TIMEOUT = 30
+
+
+def get_sync_dir(pacman_conf):
+    """ Directory where sync databases are stored """
+    return os.path.join(pacman_conf.options['DBPath'], 'sync')
+
+
+def get_db_urls(pacman_conf, repo):
+    """ Returns the urls of a repo database (only http ones) """
+    urls = []
+    for server in pacman_conf.repos.get(repo, []):
+        url = server.replace('$repo', repo)
+        url = url.replace('$arch', pacman_conf.options['Architecture'])
+        if url.startswith(('http://', 'https://')):
+            urls.append('{0}/{1}.db'.format(url.rstrip('/'), repo))
+    return urls
+
+
+def fetch_db(session, urls, db_path, force=False):
+    """ Downloads a database from the first mirror that works. If it is
+        not forced, the database is only downloaded if it has changed
+        (If-Modified-Since). Returns True if the database is up to date """
+    headers = {}
+    if not force and os.path.exists(db_path):
+        mtime = os.path.getmtime(db_path)
+        headers['If-Modified-Since'] = email.utils.formatdate(mtime, usegmt=True)
+
+    for url in urls:
+        try:
+            req = session.get(url, headers=headers, timeout=TIMEOUT)
+        except requests.exceptions.RequestException as err:
+            logging.debug("Can't download %s: %s", url, err)
+            continue
+
+        if req.status_code == requests.codes.not_modified:
+            logging.debug("%s is up to date", os.path.basename(db_path))
+            return True
+        if req.status_code != requests.codes.ok:
+            logging.debug("%s returned HTTP status %d", url, req.status_code)
+            continue
+
+        tmp_path = db_path + '.part'
+        with open(tmp_path, 'wb') as db_file:
+            db_file.write(req.content)
+        os.replace(tmp_path, db_path)
+        fetch_signature(session, url, db_path)
+
+        # alpm uses the file modification time for If-Modified-Since
+        last_modified = req.headers.get('last-modified')
+        if last_modified:
+            try:
+                mtime = email.utils.parsedate_to_datetime(last_modified).timestamp()
+                os.utime(db_path, (mtime, mtime))
+            except (TypeError, ValueError):
+                pass
+        logging.debug("%s downloaded from %s", os.path.basename(db_path), url)
+        return True
+
+    return False
+
+
+def fetch_signature(session, url, db_path):
+    """ Downloads the signature of a new database. An old signature would
+        not match it, so it is removed if the mirror has none """
+    sig_path = db_path + '.sig'
+    try:
+        req = session.get(url + '.sig', timeout=TIMEOUT)
+        if req.status_code == requests.codes.ok:
+            with open(sig_path, 'wb') as sig_file:
+                sig_file.write(req.content)
+            return
+    except requests.exceptions.RequestException as err:
+        logging.debug("Can't download %s.sig: %s", url, err)
+    if os.path.exists(sig_path):
+        os.remove(sig_path)
+
+
+def fetch(pacman_conf, force=False):
+    """ Downloads all sync databases of pacman_conf (a PacmanConfig) at the
+        same time. Returns the repos that could not be downloaded (or that
+        do not use http mirrors), so alpm can try to update them itself """
+    sync_dir = get_sync_dir(pacman_conf)
+    os.makedirs(sync_dir, mode=0o755, exist_ok=True)
+
+    failed = []
+    lock = threading.Lock()
+
+    def worker(repo, urls):
+        """ Thread that downloads one database """
+        db_path = os.path.join(sync_dir, repo + '.db')
+        with requests.Session() as session:
+            done = fetch_db(session, urls, db_path, force)
+        if not done:
+            with lock:
+                failed.append(repo)
+
+    threads = []
+    for repo in pacman_conf.repos:
+        urls = get_db_urls(pacman_conf, repo)
+        if not urls:
+            failed.append(repo)
+            continue
+        thread = threading.Thread(target=worker, args=(repo, urls), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    return failed
+
+
+def seed(src_conf, dst_conf):
+    """ Copies sync databases from src_conf's DBPath to dst_conf's DBPath
+        (for instance, from the live system to the target one). Only repos
+        that use the same mirrors in both are copied. Returns copied repos """
+    src_dir = get_sync_dir(src_conf)
+    dst_dir = get_sync_dir(dst_conf)
+    os.makedirs(dst_dir, mode=0o755, exist_ok=True)
+
+    copied = []
+    for repo, servers in dst_conf.repos.items():
+        if src_conf.repos.get(repo) != servers:
+            continue
+        src_path = os.path.join(src_dir, repo + '.db')
+        dst_path = os.path.join(dst_dir, repo + '.db')
+        if not os.path.exists(src_path):
+            continue
+        if (os.path.exists(dst_path) and
+                os.path.getmtime(dst_path) >= os.path.getmtime(src_path)):
+            continue
+        try:
+            # copy2 keeps the modification time (used by If-Modified-Since)
+            shutil.copy2(src_path, dst_path)
+            if os.path.exists(src_path + '.sig'):
+                shutil.copy2(src_path + '.sig', dst_path + '.sig')
+            copied.append(repo)
+        except OSError as err:
+            logging.warning("Can't copy %s to %s: %s", src_path, dst_path, err)
+    if copied:
+        logging.debug("Sync databases copied from %s: %s", src_dir, ', '.join(copied))
+    return copied
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  timeline.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Records how long each phase of an alpm transaction takes (package
+    extraction, scriptlets, hooks, conflict checks...) using the alpm
+    callbacks, and writes a report with the slowest ones """
+
+import csv
+import json
+import logging
+import os
+import re
+import time
+
+import pacman.alpm_include as _alpm
+
+# Transaction phases: start event -> (phase name, done event)
+PHASES = {
+    _alpm.ALPM_EVENT_CHECKDEPS_START: ('checkdeps', _alpm.ALPM_EVENT_CHECKDEPS_DONE),
+    _alpm.ALPM_EVENT_FILECONFLICTS_START: (
+        'fileconflicts', _alpm.ALPM_EVENT_FILECONFLICTS_DONE),
+    _alpm.ALPM_EVENT_RESOLVEDEPS_START: ('resolvedeps', _alpm.ALPM_EVENT_RESOLVEDEPS_DONE),
+    _alpm.ALPM_EVENT_INTERCONFLICTS_START: (
+        'interconflicts', _alpm.ALPM_EVENT_INTERCONFLICTS_DONE),
+    _alpm.ALPM_EVENT_TRANSACTION_START: ('transaction', _alpm.ALPM_EVENT_TRANSACTION_DONE),
+    _alpm.ALPM_EVENT_INTEGRITY_START: ('integrity', _alpm.ALPM_EVENT_INTEGRITY_DONE),
+    _alpm.ALPM_EVENT_LOAD_START: ('load', _alpm.ALPM_EVENT_LOAD_DONE),
+    _alpm.ALPM_EVENT_RETRIEVE_START: ('retrieve', _alpm.ALPM_EVENT_RETRIEVE_DONE),
+    _alpm.ALPM_EVENT_DISKSPACE_START: ('diskspace', _alpm.ALPM_EVENT_DISKSPACE_DONE),
+    _alpm.ALPM_EVENT_KEYRING_START: ('keyring', _alpm.ALPM_EVENT_KEYRING_DONE),
+    _alpm.ALPM_EVENT_HOOK_START: ('hooks', _alpm.ALPM_EVENT_HOOK_DONE),
+}
+
+# alpm log lines that tell which hook is running
+HOOK_RE = re.compile(r"running (?:hook )?'?([^'\s]+)'?")
+
+REPORT_NAME = 'cnchi-alpm-timeline'
+
+# Number of entries of each kind listed in the report
+DEFAULT_TOP = 20
+
+
+class Timeline():
+    """ Keeps monotonic timestamps of phases, packages and hooks.
+        Call event(), progress() and log() from the alpm callbacks.
+
+        Each package has a [start, extracted, end] list: extraction goes
+        from start to extracted (progress reaches 100%), and its install
+        scriptlet runs between extracted and end """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        # [name, start, end]
+        self.phases = []
+        self.hooks = []
+        # package name -> [start, extracted, end]
+        self.packages = {}
+        # done event -> open phase
+        self.open_phases = {}
+        self.operation_start = None
+        self.current_package = None
+        self.current_hook = None
+        self.hook_named = False
+
+    def event(self, event):
+        """ Records an alpm event """
+        now = self.clock()
+        if event in PHASES:
+            name, done_event = PHASES[event]
+            phase = [name, now, None]
+            self.phases.append(phase)
+            self.open_phases[done_event] = phase
+        elif event in self.open_phases:
+            self.open_phases.pop(event)[2] = now
+        elif event == _alpm.ALPM_EVENT_PACKAGE_OPERATION_START:
+            self.operation_start = now
+            self.current_package = None
+        elif event == _alpm.ALPM_EVENT_PACKAGE_OPERATION_DONE:
+            record = self.packages.get(self.current_package)
+            if record:
+                record[2] = now
+            self.operation_start = None
+            self.current_package = None
+        elif event == _alpm.ALPM_EVENT_HOOK_RUN_START:
+            self.current_hook = ['hook {0}'.format(len(self.hooks) + 1), now, None]
+            self.hooks.append(self.current_hook)
+            self.hook_named = False
+        elif event == _alpm.ALPM_EVENT_HOOK_RUN_DONE:
+            if self.current_hook:
+                self.current_hook[2] = now
+            self.current_hook = None
+
+    def progress(self, target, percent):
+        """ Records package extraction progress """
+        if not target or self.operation_start is None:
+            return
+        now = self.clock()
+        if target != self.current_package:
+            self.current_package = target
+            self.packages[target] = [self.operation_start, None, None]
+        record = self.packages[target]
+        if percent >= 100 and record[1] is None:
+            record[1] = now
+
+    def log(self, line):
+        """ Takes the name of the running hook from alpm log lines """
+        if self.current_hook is None or self.hook_named:
+            return
+        match = HOOK_RE.search(line)
+        if match:
+            self.current_hook[0] = match.group(1)
+            self.hook_named = True
+
+    @staticmethod
+    def get_duration(start, end):
+        """ Seconds between start and end (None if unfinished) """
+        if start is None or end is None:
+            return None
+        return round(end - start, 3)
+
+    def get_entries(self):
+        """ Returns all records as (kind, name, start offset, seconds) """
+        entries = []
+        for name, start, end in self.phases:
+            entries.append(('phase', name, start, self.get_duration(start, end)))
+        for name, (start, extracted, end) in self.packages.items():
+            entries.append(('extract', name, start, self.get_duration(start, extracted)))
+            entries.append(('scriptlet', name, extracted, self.get_duration(extracted, end)))
+        for name, start, end in self.hooks:
+            entries.append(('hook', name, start, self.get_duration(start, end)))
+        return [
+            (kind, name, round(start - self.started, 3), seconds)
+            for kind, name, start, seconds in entries
+            if start is not None]
+
+    def get_report(self, top=DEFAULT_TOP):
+        """ Returns a dict with the phase totals and the top slowest
+            packages, scriptlets and hooks """
+        entries = self.get_entries()
+
+        def slowest(kinds):
+            """ Slowest entries of these kinds """
+            found = [entry for entry in entries
+                     if entry[0] in kinds and entry[3] is not None]
+            found.sort(key=lambda entry: entry[3], reverse=True)
+            return [{'name': name, 'seconds': seconds}
+                    for _kind, name, _start, seconds in found[:top]]
+
+        packages = {}
+        for kind, name, _start, seconds in entries:
+            if kind in ('extract', 'scriptlet') and seconds is not None:
+                packages[name] = packages.get(name, 0) + seconds
+        slowest_packages = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+        phases = {}
+        for kind, name, _start, seconds in entries:
+            if kind == 'phase' and seconds is not None:
+                phases[name] = round(phases.get(name, 0) + seconds, 3)
+
+        return {
+            'total_seconds': round(self.clock() - self.started, 3),
+            'packages_count': len(self.packages),
+            'hooks_count': len(self.hooks),
+            'phases': phases,
+            'slowest_packages': [
+                {'name': name, 'seconds': round(seconds, 3)}
+                for name, seconds in slowest_packages[:top]],
+            'slowest_extractions': slowest(('extract',)),
+            'slowest_scriptlets': slowest(('scriptlet',)),
+            'slowest_hooks': slowest(('hook',))}
+
+    def write_report(self, folder, top=DEFAULT_TOP):
+        """ Writes the report (json) and all entries (csv) to folder """
+        json_path = os.path.join(folder, REPORT_NAME + '.json')
+        csv_path = os.path.join(folder, REPORT_NAME + '.csv')
+        try:
+            with open(json_path, 'w') as json_file:
+                json.dump(self.get_report(top), json_file, indent=2)
+            with open(csv_path, 'w', newline='') as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(('kind', 'name', 'start', 'seconds'))
+                writer.writerows(self.get_entries())
+        except OSError as err:
+            logging.warning("Can't write alpm timeline report: %s", err)
+            return False
+        logging.debug("alpm timeline report written to %s", json_path)
+        return True
@@ -35,9 +35,9 @@ import subprocess
 import tarfile
 import tempfile
 import dbus
+from dbus.mainloop.glib import DBusGMainLoop
 import multiprocessing
 import requests
-import time
 from packaging import version
 from gi.repository import GLib
 
@@ -85,6 +85,9 @@ class Check(GtkBaseBox):
         self.prepare_best_results = None
         self.updated = None
         self.packaging_issues = None
+        # NetworkManager StateChanged signal receiver
+        self.network_watch = None
+        self.network_changes = 0
 
         self.label_space = self.gui.get_object("label_space")
 
@@ -145,10 +148,34 @@ class Check(GtkBaseBox):
             self.forward_button.set_sensitive(self.results['check_all'])
         return not self.remove_timer
 
+    def watch_network(self):
+        """ Tells CheckProcess when NetworkManager's state changes, so it
+            checks the connection again right away """
+        try:
+            bus = dbus.SystemBus(mainloop=DBusGMainLoop())
+            self.network_watch = bus.add_signal_receiver(
+                self.on_network_state_changed, 'StateChanged', misc.NM, misc.NM)
+        except dbus.exceptions.DBusException as err:
+            logging.warning("Can't watch NetworkManager state: %s", err)
+            self.network_watch = None
+
+    def unwatch_network(self):
+        """ Stops watching NetworkManager's state """
+        if self.network_watch is not None:
+            self.network_watch.remove()
+            self.network_watch = None
+
+    def on_network_state_changed(self, state):
+        """ NetworkManager's state has changed (wakes up CheckProcess) """
+        logging.debug("NetworkManager state changed to %d", state)
+        self.network_changes += 1
+        self.settings.set('network_changes', self.network_changes)
+
     def store_values(self):
         """ Continue """
         # Remove timer
         self.remove_timer = True
+        self.unwatch_network()
         self.proc.terminate()
 
         logging.info("We have Internet connection.")
@@ -161,6 +188,7 @@ class Check(GtkBaseBox):
 
     def go_back(self):
         self.remove_timer = True
+        self.unwatch_network()
         self.proc.terminate()
 
     def check_partitioning_completion(self):
@@ -191,10 +219,20 @@ class Check(GtkBaseBox):
         self.proc.name = "check_proc"
         self.proc.start()
 
+        if self.network_watch is None:
+            self.watch_network()
+
 
 class CheckProcess(multiprocessing.Process):
     """ Thread that asks our server for user's location """
 
+    # Seconds between checks. Once all requirements are met, check_all
+    # can't go back to False (only the page indicators can change).
+    # Connectivity is checked again as soon as NetworkManager's state
+    # changes (see Check.watch_network)
+    CHECK_INTERVAL = 5
+    IDLE_CHECK_INTERVAL = 30
+
     def __init__(self, results, settings):
         super(CheckProcess, self).__init__()
         self.results = results
@@ -203,8 +241,15 @@ class CheckProcess(multiprocessing.Process):
 
     def run(self):
         while True:
+            network_changes = self.settings.get('network_changes')
             self.check_all()
-            time.sleep(5)
+            if self.results['check_all']:
+                interval = CheckProcess.IDLE_CHECK_INTERVAL
+            else:
+                interval = CheckProcess.CHECK_INTERVAL
+            # Sleep until it is time to check again or the network changes
+            self.settings.wait_for(
+                'network_changes', lambda changes: changes != network_changes, interval)
 
     def check_all(self):
         """ Check that all requirements are meet """
@@ -221,13 +266,20 @@ class CheckProcess(multiprocessing.Process):
 
         has_internet = misc.has_connection()
         self.results['internet'] = has_internet
+        if self.settings.get('has_internet') != has_internet:
+            # Wakes up processes waiting for a connection (see
+            # misc.wait_for_connection)
+            self.settings.set('has_internet', has_internet)
 
         if has_internet:
             self.results['updated']  = self.is_updated()
         else:
             self.results['updated']  = False
 
-        if has_internet and space and not packaging_issues:
+        # Offline installations (--bundle) do not need internet
+        online = has_internet or bool(self.settings.get('bundle'))
+
+        if online and space and not packaging_issues:
             self.results['check_all'] = True
 
 
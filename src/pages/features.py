@@ -40,6 +40,8 @@ import features_info
 
 import misc.extra as misc
 
+from download import prefetch
+
 from pages.gtkbasebox import GtkBaseBox
 
 from lembrame.dialog import LembrameDialog
@@ -465,6 +467,9 @@ class Features(GtkBaseBox):
 
         self.listbox_rows = {}
 
+        # Most packages are known now, start downloading them
+        prefetch.start(self.settings)
+
         return True
 
     def prepare(self, direction):
@@ -467,6 +467,9 @@ class Mirrors(GtkBaseBox):
 
     def store_values(self):
         """ Store selected values """
+        if self.settings.get('bundle'):
+            # Mirrors are not used when installing from a package bundle
+            return True
         if self.use_rankmirrors:
             self.start_rank_mirrors()
         if self.use_listboxes:
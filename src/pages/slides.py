@@ -75,6 +75,9 @@ class Slides(GtkBaseBox):
         self.downloads_progress_bar.set_show_text(True)
         self.downloads_progress_bar.set_name('a_progressbar')
 
+        # Aggregated download info (bytes, speed and ETA)
+        self.downloads_info = {'bytes': None, 'speed': None, 'eta': None}
+
         self.info_label = self.gui.get_object('info_label')
 
         self.fatal_error = False
@@ -184,6 +187,25 @@ class Slides(GtkBaseBox):
             self.should_pulse = True
             GLib.timeout_add(100, pbar_pulse)
 
+    def update_downloads_text(self):
+        """ Shows downloaded bytes, speed and ETA in the downloads progress bar """
+        texts = []
+        if self.downloads_info['bytes']:
+            done, total = self.downloads_info['bytes']
+            texts.append("{0} / {1}".format(misc.format_size(done), misc.format_size(total)))
+        if self.downloads_info['speed']:
+            texts.append("{0}/s".format(misc.format_size(self.downloads_info['speed'])))
+        eta = self.downloads_info['eta']
+        if eta is not None and eta >= 0:
+            minutes, seconds = divmod(eta, 60)
+            hours, minutes = divmod(minutes, 60)
+            if hours:
+                eta_text = "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
+            else:
+                eta_text = "{0}:{1:02d}".format(minutes, seconds)
+            texts.append(_("{0} left").format(eta_text))
+        self.downloads_progress_bar.set_text("   ".join(texts))
+
     def manage_events_from_cb_queue(self):
         """ We should be quick here and do as less as possible """
 
@@ -210,6 +232,15 @@ class Slides(GtkBaseBox):
                 self.progress_bar.set_fraction(float(event[1]))
             elif event[0] == 'downloads_percent':
                 self.downloads_progress_bar.set_fraction(float(event[1]))
+            elif event[0] == 'downloads_bytes':
+                self.downloads_info['bytes'] = event[1]
+                self.update_downloads_text()
+            elif event[0] == 'downloads_speed':
+                self.downloads_info['speed'] = event[1]
+                self.update_downloads_text()
+            elif event[0] == 'downloads_eta':
+                self.downloads_info['eta'] = event[1]
+                self.update_downloads_text()
             elif event[0] == 'progress_bar_show_text':
                 if event[1]:
                     self.progress_bar.set_text(event[1])
@@ -42,6 +42,7 @@ import desktop_info
 import features_info
 from pages.gtkbasebox import GtkBaseBox
 from installation.process import Process
+from download import prefetch
 
 import misc.extra as misc
 import show_message as show
@@ -203,6 +204,9 @@ class Summary(GtkBaseBox):
         # Check if rankmirrors is still running...
         self.wait_rankmirrors()
 
+        # Packages already prefetched will be used by the installation
+        prefetch.stop()
+
         install_screen = self.get_install_screen()
         self.process = Process(
             install_screen, self.settings, self.callback_queue)
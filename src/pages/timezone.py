@@ -34,7 +34,6 @@ import logging
 import multiprocessing
 import os
 import queue
-import time
 import urllib.request
 import urllib.error
 
@@ -301,8 +300,7 @@ class AutoTimezoneProcess(multiprocessing.Process):
         # Do not start looking for our timezone until we've reached the
         # language screen (welcome.py sets timezone_start to true when
         # next is clicked)
-        while not self.settings.get('timezone_start'):
-            time.sleep(2)
+        self.settings.wait_for('timezone_start')
 
         coords = self.use_geoip()
         if not coords:
@@ -330,14 +328,12 @@ class AutoTimezoneProcess(multiprocessing.Process):
             return [location.latitude, location.longitude]
         return None
 
-    @staticmethod
-    def maybe_wait_for_network():
+    def maybe_wait_for_network(self):
         """ Waits until there is an Internet connection available """
         if not misc.has_connection():
             logging.warning(
                 "Can't get network status. Cnchi will try again in a moment")
-            while not misc.has_connection():
-                time.sleep(4)  # Wait 4 seconds and try again
+            misc.wait_for_connection(self.settings)
         logging.debug("A working network connection has been detected.")
 
 
@@ -35,7 +35,6 @@ import logging
 import multiprocessing
 import os
 import queue
-import subprocess
 import threading
 import time
 import urllib.request
@@ -46,6 +45,7 @@ import requests
 
 import update_db
 import misc.extra as misc
+import pacman.pac as pac
 
 # When testing, no _() is available
 try:
@@ -156,18 +156,26 @@ class RankMirrors(multiprocessing.Process):
         return None
 
     @staticmethod
-    def get_package_version(name):
-        """ Returns pkg_name package version """
+    def get_package_version(pacman, name):
+        """ Returns pkg_name package version (using pacman, a pac.Pac object) """
+        pkg = pacman.lookup([name])[name]
+        if pkg is None or isinstance(pkg, list):
+            logging.warning("Can't find %s package", name)
+            return False
+        logging.debug(
+            '%s version is: %s (used to test mirror speed)', name, pkg.version)
+        return pkg.version
+
+    def get_pacman(self):
+        """ Opens alpm to look up packages """
+        conf_path = '/etc/pacman.conf'
+        if self.settings:
+            conf_path = self.settings.get('pacman_config_file')
         try:
-            cmd = ["/usr/bin/pacman", "-Ss", name]
-            line = subprocess.check_output(cmd).decode().split()
-            version = line[1]
-            logging.debug(
-                '%s version is: %s (used to test mirror speed)', name, version)
-        except subprocess.CalledProcessError as err:
-            logging.warning(err)
-            version = False
-        return version
+            return pac.Pac(conf_path)
+        except pac.pyalpm.error as err:
+            logging.warning("Can't initialize pyalpm: %s", err)
+            return None
 
     def sort_mirrors_by_speed(self, mirrors=None, max_threads=8):
         """ Sorts mirror list """
@@ -178,8 +186,15 @@ class RankMirrors(multiprocessing.Process):
 
         rated_mirrors = {'arch': [], 'antergos': []}
 
+        pacman = self.get_pacman()
         for key, value in test_packages.items():
-            test_packages[key]['version'] = self.get_package_version(value['name'])
+            if pacman:
+                test_packages[key]['version'] = self.get_package_version(
+                    pacman, value['name'])
+            else:
+                test_packages[key]['version'] = False
+        if pacman:
+            pacman.release()
 
         total_num_mirrors = 0
         for key in mirrors.keys():
@@ -363,8 +378,7 @@ class RankMirrors(multiprocessing.Process):
     def run(self):
         """ Run process """
         # Wait until there is an Internet connection available
-        while not misc.has_connection():
-            time.sleep(2)  # Delay, try again after 2 seconds
+        misc.wait_for_connection(self.settings, retry=2)
 
         logging.debug("Updating both mirrorlists (Arch and Antergos)...")
         self.update_mirrorlists()
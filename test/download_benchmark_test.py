@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# download_benchmark_test.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Download benchmark. Runs download_requests.Download against local fake
+    mirrors that can be told to be slow, to drop connections, to lose
+    packages or to send corrupted data.
+
+    As a test (pytest) it runs every scenario with a few small packages.
+    Run it directly to benchmark, for instance:
+        ./download_benchmark_test.py --packages 200 --workers 1,4,8 """
+
+import argparse
+import hashlib
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_DIR)
+sys.path.append(os.path.join(PARENT_DIR, 'src'))
+
+import download.download_requests as download_requests
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """ Serves packages of the mirror that owns the server """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        """ Do not log requests """
+        pass
+
+    def do_GET(self):
+        """ Sends a package (or part of it) """
+        self.server.mirror.handle(self)
+
+
+class FakeMirror():
+    """ Local http mirror. Faults:
+            latency: seconds to wait before answering
+            throttle: max bytes per second of each connection
+            disconnect_after: close the connection after sending these bytes
+                (only the first time each package is requested)
+            missing: fraction of packages that are not found (404)
+            corrupt: fraction of packages sent with wrong data """
+
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, packages, latency=0, throttle=0, disconnect_after=0,
+                 missing=0, corrupt=0, seed=0):
+        self.packages = packages
+        self.latency = latency
+        self.throttle = throttle
+        self.disconnect_after = disconnect_after
+
+        rand = random.Random(seed)
+        names = sorted(packages)
+        self.missing = set(rand.sample(names, int(len(names) * missing)))
+        self.corrupt = set(rand.sample(names, int(len(names) * corrupt)))
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.disconnected = set()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MirrorHandler)
+        self.server.daemon_threads = True
+        self.server.mirror = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """ Base url of the mirror """
+        return 'http://127.0.0.1:{0}/'.format(self.server.server_address[1])
+
+    def start(self):
+        """ Starts serving """
+        self.thread.start()
+
+    def stop(self):
+        """ Stops serving """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler):
+        """ Answers a request """
+        with self.lock:
+            self.requests += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        name = os.path.basename(handler.path)
+        if name not in self.packages or name in self.missing:
+            handler.send_error(404)
+            return
+
+        data = self.packages[name]
+        if name in self.corrupt:
+            data = bytes(reversed(data))
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-(\d*)', handler.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else len(data)
+            if start >= len(data):
+                handler.send_response(416)
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return
+            handler.send_response(206)
+            handler.send_header(
+                'Content-Range', 'bytes {0}-{1}/{2}'.format(start, end - 1, len(data)))
+            data = data[start:end]
+        else:
+            handler.send_response(200)
+        handler.send_header('Accept-Ranges', 'bytes')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+
+        limit = len(data)
+        with self.lock:
+            if self.disconnect_after and name not in self.disconnected:
+                self.disconnected.add(name)
+                limit = min(limit, self.disconnect_after)
+
+        sent = 0
+        started = time.perf_counter()
+        try:
+            while sent < limit:
+                chunk = data[sent:min(limit, sent + FakeMirror.CHUNK_SIZE)]
+                handler.wfile.write(chunk)
+                sent += len(chunk)
+                with self.lock:
+                    self.bytes_sent += len(chunk)
+                if self.throttle:
+                    wait = sent / self.throttle - (time.perf_counter() - started)
+                    if wait > 0:
+                        time.sleep(wait)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        if sent < len(data):
+            handler.close_connection = True
+            try:
+                handler.connection.shutdown(2)
+            except OSError:
+                # The client has already closed the connection
+                pass
+
+
+SCENARIOS = {
+    'clean': {},
+    'latency': {'latency': 0.05},
+    'throttle': {'throttle': 4 * 1024 * 1024},
+    'disconnect': {'disconnect_after': 32 * 1024},
+    'missing': {'missing': 0.3},
+    'corrupt': {'corrupt': 0.3},
+}
+
+
+def create_packages(num_packages, max_size, seed=0):
+    """ Creates synthetic packages and their download elements (as the
+        ones metalink.create_plan returns) """
+    rand = random.Random(seed)
+    packages = {}
+    elements = {}
+    for index in range(num_packages):
+        identity = 'bench{0}'.format(index)
+        filename = '{0}-1.0-1-x86_64.pkg.tar.xz'.format(identity)
+        size = rand.randint(1024, max_size)
+        data = rand.getrandbits(size * 8).to_bytes(size, 'little')
+        packages[filename] = data
+        elements[identity] = {
+            'identity': identity,
+            'filename': filename,
+            'version': '1.0-1',
+            'size': size,
+            'hash': {'sha256': hashlib.sha256(data).hexdigest()},
+            'urls': []}
+    return packages, elements
+
+
+def run_scenario(scenario, packages, elements, workers):
+    """ Downloads all packages from a faulty mirror (listed first) and a good
+        one. Returns a dict with the results """
+    faulty = FakeMirror(packages, **SCENARIOS[scenario])
+    good = FakeMirror(packages)
+    faulty.start()
+    good.start()
+
+    for element in elements.values():
+        element['urls'] = [faulty.url + element['filename'], good.url + element['filename']]
+
+    cache_dir = tempfile.mkdtemp(prefix='cnchi-bench-')
+    try:
+        downloader = download_requests.Download(cache_dir, [], None, max_workers=workers)
+        started = time.perf_counter()
+        result = downloader.start(elements)
+        wall_time = time.perf_counter() - started
+
+        # Every package must be there (and be right)
+        missing = [
+            element['filename'] for element in elements.values()
+            if not os.path.exists(os.path.join(cache_dir, element['filename']))]
+        verified = not missing
+        for element in elements.values():
+            if element['filename'] in missing:
+                continue
+            path = os.path.join(cache_dir, element['filename'])
+            with open(path, 'rb') as package_file:
+                digest = hashlib.sha256(package_file.read()).hexdigest()
+            if digest != element['hash']['sha256']:
+                verified = False
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        faulty.stop()
+        good.stop()
+
+    total_bytes = sum(len(data) for data in packages.values())
+    requests_made = faulty.requests + good.requests
+    failures = sum(stats.total_failures for stats in downloader.mirrors.hosts.values())
+    return {
+        'scenario': scenario,
+        'workers': workers,
+        'result': result,
+        'missing': missing,
+        'verified': verified,
+        'wall_time': wall_time,
+        'throughput': total_bytes / wall_time if wall_time > 0 else 0,
+        'bytes_sent': faulty.bytes_sent + good.bytes_sent,
+        'retries': requests_made - len(packages),
+        'failures': failures}
+
+
+def print_results(results):
+    """ Shows results as a table """
+    print("{0:<12} {1:>7} {2:>6} {3:>9} {4:>10} {5:>10} {6:>8} {7:>8}".format(
+        'scenario', 'workers', 'ok', 'time (s)', 'MiB/s', 'sent MiB', 'retries', 'failures'))
+    for res in results:
+        print("{0:<12} {1:>7} {2:>6} {3:>9.2f} {4:>10.2f} {5:>10.2f} {6:>8} {7:>8}".format(
+            res['scenario'], res['workers'], str(res['result'] and res['verified']),
+            res['wall_time'], res['throughput'] / (1024 * 1024),
+            res['bytes_sent'] / (1024 * 1024), res['retries'], res['failures']))
+
+
+def test():
+    """ All scenarios must end with all packages downloaded and verified """
+    packages, elements = create_packages(num_packages=12, max_size=256 * 1024)
+    for scenario in SCENARIOS:
+        res = run_scenario(scenario, packages, elements, workers=4)
+        assert res['result'], scenario
+        assert not res['missing'], (scenario, res['missing'])
+        assert res['verified'], scenario
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description="Cnchi download benchmark")
+    parser.add_argument(
+        '--packages', type=int, default=50, help="Number of packages")
+    parser.add_argument(
+        '--max-size', type=int, default=4, help="Maximum package size (MiB)")
+    parser.add_argument(
+        '--workers', default='1,6', help="Comma separated worker counts to compare")
+    parser.add_argument(
+        '--scenarios', default=','.join(SCENARIOS), help="Comma separated scenarios")
+    parser.add_argument(
+        '--debug', action='store_true', help="Show Cnchi log messages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.CRITICAL)
+
+    packages, elements = create_packages(args.packages, args.max_size * 1024 * 1024)
+    results = []
+    for scenario in args.scenarios.split(','):
+        for workers in args.workers.split(','):
+            results.append(run_scenario(scenario, packages, elements, int(workers)))
+    print_results(results)
+
+
+if __name__ == '__main__':
+    main()
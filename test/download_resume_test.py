@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# download_resume_test.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Resume test: .part files left by an interrupted segmented download
+    (preallocated to the whole package size) can't be resumed. They must
+    be downloaded again from scratch without blaming the mirror """
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_DIR)
+sys.path.append(os.path.join(PARENT_DIR, 'src'))
+sys.path.append(os.path.join(PARENT_DIR, 'test'))
+
+import download.download_requests as download_requests
+from download_benchmark_test import FakeMirror, create_packages
+
+
+def download_with_stale_parts(known_size):
+    """ Downloads packages that have a full size (zeroed) .part file.
+        Without known_size the mirror answers the resume with a 416 """
+    packages, elements = create_packages(num_packages=3, max_size=64 * 1024)
+    mirror = FakeMirror(packages)
+    mirror.start()
+
+    cache_dir = tempfile.mkdtemp(prefix='cnchi-resume-')
+    try:
+        for element in elements.values():
+            element['urls'] = [mirror.url + element['filename']]
+            part_path = os.path.join(
+                cache_dir, element['filename'] + download_requests.Download.PART_SUFFIX)
+            with open(part_path, 'wb') as part_file:
+                part_file.truncate(element['size'])
+            if not known_size:
+                del element['size']
+
+        downloader = download_requests.Download(cache_dir, [], None, max_workers=2)
+        assert downloader.start(elements)
+
+        for filename, data in packages.items():
+            path = os.path.join(cache_dir, filename)
+            assert os.path.exists(path), filename
+            with open(path, 'rb') as package_file:
+                digest = hashlib.sha256(package_file.read()).hexdigest()
+            assert digest == hashlib.sha256(data).hexdigest(), filename
+        failures = sum(stats.total_failures for stats in downloader.mirrors.hosts.values())
+        assert failures == 0
+    finally:
+        mirror.stop()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test():
+    """ Stale .part files are discarded (known size or 416 answer) """
+    download_with_stale_parts(known_size=True)
+    download_with_stale_parts(known_size=False)
+
+
+if __name__ == '__main__':
+    test()
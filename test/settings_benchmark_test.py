@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# settings_benchmark_test.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Settings benchmark. Compares the cost of config.Settings get and set
+    calls with the previous implementation (the whole settings dict kept
+    in a one element multiprocessing queue).
+
+    As a test (pytest) it checks that both behave the same, also when
+    used from another process, and that Settings.wait_for and
+    Settings.subscribe wake up when a key is set. Run it directly to
+    benchmark, for instance:
+        ./settings_benchmark_test.py --calls 5000 """
+
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_DIR)
+sys.path.append(os.path.join(PARENT_DIR, 'src'))
+
+import config
+
+
+class QueueSettings():
+    """ Previous Settings implementation: each call takes the whole dict
+        out of the queue, copies it and puts it back """
+
+    def __init__(self, defaults):
+        self._manager = multiprocessing.Manager()
+        self._settings = self._manager.Queue(1)
+        self._settings.put(dict(defaults))
+
+    def _get_settings(self):
+        """ Get a copy of our settings """
+        settings = self._settings.get()
+        copy = settings.copy()
+        self._settings.put(settings)
+        return copy
+
+    def _update_settings(self, new_settings):
+        """ Updates global settings """
+        settings = self._settings.get()
+        try:
+            settings.update(new_settings)
+        finally:
+            self._settings.put(settings)
+
+    def get(self, key):
+        """ Get one setting value """
+        settings = self._get_settings()
+        return settings.get(key, None)
+
+    def set(self, key, value):
+        """ Set one setting value """
+        settings = self._get_settings()
+        current = settings.get(key, 'keyerror')
+        exists = current != 'keyerror'
+
+        if exists and current and isinstance(current, list) and not isinstance(value, list):
+            settings[key].append(value)
+        else:
+            settings[key] = value
+
+        self._update_settings(settings)
+
+
+def create_settings(implementation):
+    """ Returns a settings object with Cnchi default values """
+    settings = config.Settings()
+    if implementation == 'queue':
+        return QueueSettings(settings._settings.copy())
+    return settings
+
+
+def child_worker(settings):
+    """ Changes settings from another process """
+    settings.set('timezone_start', True)
+    settings.set('xz_cache', '/child/cache')
+
+
+def check_settings(settings):
+    """ Checks get/set semantics (list values get appended) """
+    assert settings.get('bootloader') == 'grub2'
+    assert settings.get('no_such_key') is None
+
+    settings.set('desktop', 'kde')
+    assert settings.get('desktop') == 'kde'
+
+    settings.set('xz_cache', '/first/cache')
+    assert settings.get('xz_cache') == '/first/cache'
+    settings.set('xz_cache', ['/first/cache'])
+    settings.set('xz_cache', '/second/cache')
+    assert settings.get('xz_cache') == ['/first/cache', '/second/cache']
+
+    # Values read are copies
+    settings.get('xz_cache').append('/not/stored')
+    assert settings.get('xz_cache') == ['/first/cache', '/second/cache']
+
+    process = multiprocessing.Process(target=child_worker, args=(settings,))
+    process.start()
+    process.join()
+    assert settings.get('timezone_start') is True
+    assert settings.get('xz_cache') == ['/first/cache', '/second/cache', '/child/cache']
+
+
+def delayed_worker(settings, delay):
+    """ Sets timezone_start after a while (from another process) """
+    time.sleep(delay)
+    settings.set('timezone_start', True)
+
+
+def check_notifications(settings):
+    """ Checks that waiters and subscribers are woken up by set() """
+    assert not settings.wait_for('timezone_start', timeout=0.1)
+
+    changes = queue.Queue()
+    subscription = settings.subscribe(
+        'timezone_start', lambda key, value: changes.put((key, value)))
+
+    process = multiprocessing.Process(target=delayed_worker, args=(settings, 0.2))
+    started = time.monotonic()
+    process.start()
+    assert settings.wait_for('timezone_start', timeout=10)
+    assert time.monotonic() - started < 5
+    assert changes.get(timeout=10) == ('timezone_start', True)
+    process.join()
+
+    assert settings.wait_for('desktop', lambda value: value == 'gnome', timeout=0)
+    subscription.cancel()
+
+
+def measure(settings, calls):
+    """ Returns the mean cost (in microseconds) of get and set calls """
+    started = time.perf_counter()
+    for _index in range(calls):
+        settings.get('desktop')
+    get_cost = (time.perf_counter() - started) / calls * 1e6
+
+    started = time.perf_counter()
+    for index in range(calls):
+        settings.set('partition_mode', index)
+    set_cost = (time.perf_counter() - started) / calls * 1e6
+
+    return get_cost, set_cost
+
+
+def test():
+    """ Both implementations must behave the same """
+    for implementation in ('queue', 'store'):
+        check_settings(create_settings(implementation))
+    check_notifications(create_settings('store'))
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description="Cnchi settings benchmark")
+    parser.add_argument(
+        '--calls', type=int, default=2000, help="Number of get and set calls")
+    args = parser.parse_args()
+
+    print("{0:<10} {1:>12} {2:>12}".format('backend', 'get (us)', 'set (us)'))
+    for implementation in ('queue', 'store'):
+        get_cost, set_cost = measure(create_settings(implementation), args.calls)
+        print("{0:<10} {1:>12.1f} {2:>12.1f}".format(implementation, get_cost, set_cost))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# staging_test.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Staging download test: packages already in the xz cache must not be
+    downloaded again """
+
+import os
+import shutil
+import sys
+import tempfile
+
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_DIR)
+sys.path.append(os.path.join(PARENT_DIR, 'src'))
+sys.path.append(os.path.join(PARENT_DIR, 'test'))
+
+import download.staging as staging
+from download_benchmark_test import FakeMirror, create_packages
+
+
+def test():
+    """ Only packages that are not in the xz cache are requested """
+    packages, elements = create_packages(num_packages=6, max_size=64 * 1024)
+    mirror = FakeMirror(packages)
+    mirror.start()
+    for element in elements.values():
+        element['urls'] = [mirror.url + element['filename']]
+
+    temp_dir = tempfile.mkdtemp(prefix='cnchi-staging-')
+    xz_cache = os.path.join(temp_dir, 'xz_cache')
+    os.makedirs(xz_cache)
+    cached = sorted(packages)[:3]
+    for filename in cached:
+        with open(os.path.join(xz_cache, filename), 'wb') as package_file:
+            package_file.write(packages[filename])
+
+    settings = {
+        'temp': temp_dir,
+        'xz_cache': [xz_cache],
+        'download_workers': 2}
+    try:
+        download = staging.StagingDownload(elements, settings)
+        download.run()
+        assert download.result
+        staging_dir = staging.get_staging_dir(settings)
+        for filename in packages:
+            staged = os.path.exists(os.path.join(staging_dir, filename))
+            assert staged == (filename not in cached), filename
+        assert mirror.requests == len(packages) - len(cached)
+    finally:
+        mirror.stop()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# build_bundle.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Builds an offline package bundle for a desktop and a set of features.
+    The bundle has the sync databases, all packages needed (with their
+    dependencies) and a manifest. Use it with 'cnchi --bundle <path>'.
+
+    Example (as root, in an up to date Antergos system):
+        ./build_bundle.py --desktop gnome --features firefox,office \\
+            --output /srv/bundle --squashfs /srv/gnome.sqfs """
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import xml.etree.cElementTree as elementTree
+
+CNCHI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(CNCHI_DIR)
+sys.path.append(os.path.join(CNCHI_DIR, 'src'))
+
+import config
+import pacman.pac as pac
+import download.bundle as bundle
+import download.download_requests as download_requests
+import download.metalink as ml
+from installation import select_packages as pack
+
+
+def select_packages(settings, args):
+    """ Selects packages like Cnchi does. All bootloaders are included, as
+        we do not know which one will be chosen """
+    pkg = pack.SelectPackages(settings, None)
+    pkg.load_xml_root_node()
+    pkg.add_edition_packages()
+    if args.drivers:
+        # Drivers needed by this computer
+        pkg.add_drivers()
+    pkg.add_filesystems()
+    pkg.maybe_add_chinese_fonts()
+    for child in pkg.xml_root.iter('bootloader'):
+        for xml_pkg in child.iter('pkgname'):
+            pkg.add_package(xml_pkg)
+    pkg.add_features()
+    if args.extra:
+        pkg.packages.extend(args.extra.split(','))
+    pkg.cleanup_packages_list()
+    return pkg.packages, pkg.xml_root
+
+
+def copy_databases(pacman, repo_dir):
+    """ Copies sync databases (and their signatures) to repo_dir.
+        Returns repo names """
+    pacman_conf = pacman.get_config()
+    sync_dir = os.path.join(pacman_conf.options['DBPath'], 'sync')
+    repos = list(pacman_conf.repos.keys())
+    for repo in repos:
+        for suffix in ('.db', '.db.sig'):
+            src = os.path.join(sync_dir, repo + suffix)
+            if os.path.exists(src):
+                shutil.copy2(src, repo_dir)
+    return repos
+
+
+def write_manifest(output_dir, args, repos, plan):
+    """ Writes the bundle manifest """
+    manifest = {
+        'version': bundle.MANIFEST_VERSION,
+        'created': datetime.datetime.utcnow().isoformat(),
+        'arch': os.uname()[-1],
+        'desktop': args.desktop,
+        'features': args.features.split(',') if args.features else [],
+        'repos': repos,
+        'packages': [
+            {'name': entry['identity'],
+             'version': entry['version'],
+             'filename': entry['filename'],
+             'size': entry['size'],
+             'hash': entry['hash']}
+            for entry in plan.values()]}
+    path = os.path.join(output_dir, bundle.MANIFEST_NAME)
+    with open(path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def build(args):
+    """ Builds the bundle. Returns True if all went fine """
+    settings = config.Settings()
+    settings.set('desktop', args.desktop)
+    settings.set('locale', args.locale)
+    settings.set('language_code', args.locale.split('.')[0])
+    settings.set('data', os.path.join(CNCHI_DIR, 'data'))
+    settings.set('alternate_package_list', args.packagelist)
+    for feature in args.features.split(',') if args.features else []:
+        settings.set('feature_' + feature, True)
+
+    packages, xml_root = select_packages(settings, args)
+    logging.info("%d packages selected", len(packages))
+
+    pacman = pac.Pac(args.pacman_conf)
+    if args.refresh and not pacman.refresh():
+        logging.error("Can't refresh pacman databases")
+        return False
+
+    plan = ml.create_plan(pacman, packages, args.pacman_conf)
+    if plan is None:
+        logging.error("Can't resolve package dependencies")
+        return False
+    logging.info("%d packages (with dependencies) will be bundled", len(plan))
+
+    repo_dir = bundle.get_repo_dir(args.output)
+    os.makedirs(repo_dir, mode=0o755, exist_ok=True)
+    repos = copy_databases(pacman, repo_dir)
+    pacman.release()
+
+    # Packages already in the local cache are copied, the rest downloaded
+    downloader = download_requests.Download(repo_dir, [args.cache], None)
+    if not downloader.start(plan):
+        logging.error("Can't get all packages")
+        return False
+    downloader.wait_cache_writes()
+
+    elementTree.ElementTree(xml_root).write(
+        os.path.join(args.output, bundle.PACKAGES_XML_NAME),
+        encoding='utf-8', xml_declaration=True)
+
+    write_manifest(args.output, args, repos, plan)
+
+    if args.squashfs:
+        logging.info("Creating squashfs image %s", args.squashfs)
+        subprocess.check_call(['mksquashfs', args.output, args.squashfs, '-noappend'])
+
+    logging.info("Bundle ready in %s", args.output)
+    return True
+
+
+def main():
+    """ Parses arguments and builds the bundle """
+    parser = argparse.ArgumentParser(description="Builds a Cnchi offline package bundle")
+    parser.add_argument(
+        '--desktop', default='base', help="Desktop to install (as in packages.xml)")
+    parser.add_argument(
+        '--features', default='', help="Comma separated features (firefox,office...)")
+    parser.add_argument(
+        '--extra', default='', help="Comma separated additional packages")
+    parser.add_argument(
+        '--drivers', action='store_true', help="Add drivers needed by this computer")
+    parser.add_argument(
+        '--locale', default='en_US.UTF-8', help="Locale (selects language packages)")
+    parser.add_argument(
+        '--packagelist', default=os.path.join(CNCHI_DIR, 'data', 'packages.xml'),
+        help="Cnchi packages.xml file")
+    parser.add_argument(
+        '--pacman-conf', default='/etc/pacman.conf', help="pacman.conf to use")
+    parser.add_argument(
+        '--cache', default='/var/cache/pacman/pkg', help="Copy packages from this cache")
+    parser.add_argument(
+        '--refresh', action='store_true', help="Refresh sync databases first")
+    parser.add_argument(
+        '--output', required=True, help="Bundle directory")
+    parser.add_argument(
+        '--squashfs', help="Also create this squashfs image of the bundle")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(0 if build(args) else 1)
+
+
+if __name__ == '__main__':
+    main()